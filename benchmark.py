@@ -0,0 +1,222 @@
+"""
+Benchmarks for the Tower Defense Game.
+
+Run with `python3 benchmark.py <name>`, where name is one of the benchmarks below.
+The render benchmark opens a Tk window, so it needs a display.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from tkinter import Tk, Canvas as TkCanvas
+
+from engine import TOWER_STATS, Simulation
+from game_solution import CanvasRenderer, GameLoop, MapGenerator
+
+STARTUP_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import game_solution
+imported = time.perf_counter()
+game = game_solution.Game()
+game.root.update()
+shown = time.perf_counter()
+game.root.destroy()
+print(json.dumps({"import": imported - start, "main_menu": shown - start}))
+"""
+
+
+def create_board(num_circles, use_background_image):
+    """
+    Create a window with the map drawn and a simulation with circles spread along the route.
+
+    Args:
+        num_circles (int): The number of circles on the route.
+        use_background_image (bool): Whether to draw the map as a single image.
+
+    Returns:
+        tuple: The root window, the canvas and the simulation.
+    """
+    root = Tk()
+    canvas = TkCanvas(root, width=1000, height=720, bg="white")
+    map_generator = MapGenerator(canvas, 50, 36, cell_size=20,
+                                 use_background_image=use_background_image)
+    map_generator.draw_map_from_file("coords.txt")
+
+    simulation = Simulation()
+    spacing = simulation.route.length / 2 / num_circles
+    for i in range(num_circles):
+        simulation.spawn_circle().distance = i * spacing
+    simulation.running = True
+    root.update()
+    return root, canvas, simulation
+
+
+def legacy_render_fps(num_circles, frames):
+    """
+    Measure frames per second when every circle step is drawn and flushed on its own
+    over a map of one rectangle per cell, the way the game was drawn before.
+
+    Args:
+        num_circles (int): The number of circles on the route.
+        frames (int): The number of frames to time.
+
+    Returns:
+        float: The frames per second.
+    """
+    root, canvas, simulation = create_board(num_circles, use_background_image=False)
+    items = [canvas.create_oval(-100, -100, -80, -80, fill='black')
+             for _ in simulation.circles]
+    indexes = [int(simulation.route.index_at(circle.distance)) for circle in simulation.circles]
+
+    start = time.perf_counter()
+    for _ in range(frames):
+        for circle_number, item in enumerate(items):
+            x, y = simulation.route[indexes[circle_number]]
+            canvas.coords(item, x, y, x + 20, y + 20)
+            canvas.update()
+            indexes[circle_number] += 1
+    elapsed = time.perf_counter() - start
+    root.destroy()
+    return frames / elapsed
+
+
+def batched_render_fps(num_circles, frames):
+    """
+    Measure frames per second when a whole simulation step is drawn in one batch
+    over a map drawn as a single background image.
+
+    Args:
+        num_circles (int): The number of circles on the route.
+        frames (int): The number of frames to time.
+
+    Returns:
+        float: The frames per second.
+    """
+    root, canvas, simulation = create_board(num_circles, use_background_image=True)
+    renderer = CanvasRenderer(canvas, simulation, 20)
+    renderer.draw()
+
+    start = time.perf_counter()
+    for _ in range(frames):
+        simulation.move_circles(simulation.step_ms)
+        renderer.draw()
+        root.update()
+    elapsed = time.perf_counter() - start
+    root.destroy()
+    return frames / elapsed
+
+
+def render_benchmark(args):
+    """
+    Print the frames per second before and after batching for several circle counts.
+
+    Args:
+        args (Namespace): The parsed command line arguments.
+    """
+    print(f"{'circles':>8} {'before fps':>12} {'after fps':>12}")
+    for num_circles in args.circles:
+        before = legacy_render_fps(num_circles, args.frames)
+        after = batched_render_fps(num_circles, args.frames)
+        print(f"{num_circles:>8} {before:>12.1f} {after:>12.1f}")
+
+
+def timers_benchmark(args):
+    """
+    Run a long session at maximum speed and print, once per wave, how many Tk timers
+    are scheduled, how many canvas items exist and how many circles are on the route.
+    The timers should stay flat however long the session runs, and the canvas items
+    should only grow with the most circles ever on the route at once.
+
+    Args:
+        args (Namespace): The parsed command line arguments.
+    """
+    root = Tk()
+    canvas = TkCanvas(root, width=1000, height=720, bg="white")
+    canvas.pack()
+    MapGenerator(canvas, 50, 36, cell_size=20,
+                 use_background_image=True).draw_map_from_file("coords.txt")
+
+    simulation = Simulation()
+    simulation.player.health = float("inf")  # Keep the session going
+    with open("save.json", "r", encoding="utf8") as save_file:
+        for tower in json.load(save_file)["towers"]:
+            simulation.add_tower(*tower["coordinates"], **TOWER_STATS[tower["type"]],
+                                 tower_type=tower["type"])
+    renderer = CanvasRenderer(canvas, simulation, 20)
+    game_loop = GameLoop(root, simulation, renderer.draw)
+    game_loop.set_time_scale(None)
+    game_loop.start()
+    simulation.new_wave()
+
+    print(f"{'wave':>5} {'timers':>7} {'items':>7} {'circles':>8}")
+    wave = 0
+    while simulation.current_wave <= args.waves:
+        root.update()
+        if simulation.current_wave != wave:
+            wave = simulation.current_wave
+            timers = len(root.tk.splitlist(root.tk.call("after", "info")))
+            print(f"{wave:>5} {timers:>7} {len(canvas.find_all()):>7} "
+                  f"{len(simulation.circles):>8}")
+    game_loop.stop()
+    root.destroy()
+
+
+def measure_startup():
+    """
+    Start the game in a fresh interpreter and time how long it takes to import the
+    module and to show the main menu.
+
+    Returns:
+        dict: The seconds taken until "import" finished and until the "main_menu" was shown.
+    """
+    output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT],
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def startup_benchmark(args):
+    """
+    Print the median time to import the module and to show the main menu.
+
+    Args:
+        args (Namespace): The parsed command line arguments.
+    """
+    runs = [measure_startup() for _ in range(args.runs)]
+    import_ms = statistics.median(run["import"] for run in runs) * 1000
+    main_menu_ms = statistics.median(run["main_menu"] for run in runs) * 1000
+    print(f"import:       {import_ms:8.1f} ms")
+    print(f"main menu:    {main_menu_ms:8.1f} ms")
+
+
+def main():
+    """
+    Parse the command line and run the selected benchmark.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    render_parser = subparsers.add_parser(
+        "render", help="frames per second with many circles on the canvas")
+    render_parser.add_argument("--circles", type=int, nargs="+", default=[50, 200, 500])
+    render_parser.add_argument("--frames", type=int, default=200)
+    render_parser.set_defaults(func=render_benchmark)
+
+    timers_parser = subparsers.add_parser(
+        "timers", help="Tk timers and canvas items over a long session")
+    timers_parser.add_argument("--waves", type=int, default=30)
+    timers_parser.set_defaults(func=timers_benchmark)
+
+    startup_parser = subparsers.add_parser(
+        "startup", help="time to import the module and to show the main menu")
+    startup_parser.add_argument("--runs", type=int, default=5)
+    startup_parser.set_defaults(func=startup_benchmark)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
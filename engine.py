@@ -0,0 +1,2019 @@
+"""
+This module contains the engine of the Tower Defense Game: the route, the towers,
+the circles and the Simulation that runs the waves. It does not import Tkinter, so
+the game can be simulated and batch run on machines without a display.
+"""
+import argparse
+import hashlib
+import heapq
+import json
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+from math import atan2
+import numpy as np
+
+
+def read_coordinates(filename):
+    """
+    Read coordinates from a file and return a list of tuples.
+
+    Args:
+        filename (str): The path to the file containing the coordinates.
+
+    Returns:
+        list: A list of tuples representing the coordinates.
+    """
+    coordinates = []
+    with open(filename, 'r', encoding="utf8") as file:
+        for line in file:
+            x, y = map(float, line.replace(
+                '(', '').replace(')', '').split(','))
+            coordinates.append((x, y))
+    return coordinates
+
+
+COMPILED_MAGIC = b"TDCO"
+COMPILED_VERSION = 1
+COMPILED_HEADER = struct.Struct("<4sH2sIqQ4x")
+ROUTE_COMPILER_VERSION = 2
+
+
+def compiled_coordinates_path(filename, dtype="f8", cache_dir="map_cache"):
+    """
+    Return the path of the compiled binary version of a coordinates file.
+
+    The name holds a hash of the absolute path of the text file and of the data type,
+    so files with the same name in different directories, or the same file loaded as
+    floats and as tile numbers, each get their own compiled file.
+
+    Args:
+        filename (str): The path to the text file containing the coordinates.
+        dtype (str, optional): The data type the coordinates are stored as
+            (default is "f8").
+        cache_dir (str, optional): The directory compiled files are saved in
+            (default is "map_cache").
+
+    Returns:
+        str: The path of the compiled file.
+    """
+    key = hashlib.sha256(repr((os.path.abspath(filename), dtype)).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{os.path.basename(filename)}_{key}.bin")
+
+
+def write_compiled_coordinates(path, coordinates, dtype, source_mtime_ns=0, source_size=0):
+    """
+    Write coordinates to a compact binary file.
+
+    The binary file starts with a header holding a magic number, the format version,
+    the data type, the number of coordinates and the modification time and size of
+    the text file it was compiled from. The coordinates follow as packed (x, y) pairs.
+    The file is written under a temporary name first, so a half-written file is never
+    loaded.
+
+    Args:
+        path (str): The path of the binary file.
+        coordinates (array_like): The (x, y) coordinates.
+        dtype (str): The little-endian NumPy data type the coordinates are stored as,
+            "f8" for floats or "i4" for whole tile numbers.
+        source_mtime_ns (int, optional): The modification time of the source file in
+            nanoseconds (default is 0).
+        source_size (int, optional): The size of the source file in bytes (default is 0).
+    """
+    coordinates = np.asarray(coordinates, dtype="<" + dtype).reshape(-1, 2)
+    header = COMPILED_HEADER.pack(COMPILED_MAGIC, COMPILED_VERSION, dtype.encode(),
+                                  len(coordinates), source_mtime_ns, source_size)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(header)
+        file.write(coordinates.tobytes())
+    os.replace(temporary_path, path)
+
+
+def map_compiled_coordinates(path, dtype):
+    """
+    Memory-map the coordinates of a compact binary file.
+
+    Args:
+        path (str): The path of the binary file.
+        dtype (str): The data type the coordinates are stored as.
+
+    Returns:
+        ndarray: A read-only array of shape (number of coordinates, 2).
+    """
+    with open(path, "rb") as file:
+        count = COMPILED_HEADER.unpack(file.read(COMPILED_HEADER.size))[3]
+    if count == 0:
+        return np.empty((0, 2), dtype="<" + dtype)
+    return np.memmap(path, dtype="<" + dtype, mode="r",
+                     offset=COMPILED_HEADER.size, shape=(count, 2))
+
+
+def compile_coordinates(filename, dtype="f8", cache_dir="map_cache"):
+    """
+    Parse a coordinates text file and write its coordinates to a compact binary file.
+
+    Args:
+        filename (str): The path to the text file containing the coordinates.
+        dtype (str, optional): The little-endian NumPy data type the coordinates are
+            stored as, "f8" for floats or "i4" for whole tile numbers (default is "f8").
+        cache_dir (str, optional): The directory compiled files are saved in
+            (default is "map_cache").
+
+    Returns:
+        str: The path of the compiled file.
+    """
+    source = os.stat(filename)
+    path = compiled_coordinates_path(filename, dtype, cache_dir)
+    write_compiled_coordinates(path, read_coordinates(filename), dtype,
+                               source.st_mtime_ns, source.st_size)
+    return path
+
+
+def compiled_coordinates_current(filename, dtype="f8", cache_dir="map_cache"):
+    """
+    Check whether the compiled version of a coordinates file exists and matches it.
+
+    Only the header is read, and the text file is compared by its modification time
+    and size, so checking does not parse anything.
+
+    Args:
+        filename (str): The path to the text file containing the coordinates.
+        dtype (str, optional): The data type the coordinates should be stored as
+            (default is "f8").
+        cache_dir (str, optional): The directory compiled files are saved in
+            (default is "map_cache").
+
+    Returns:
+        bool: True if the compiled file can be loaded instead of the text file.
+    """
+    try:
+        with open(compiled_coordinates_path(filename, dtype, cache_dir), "rb") as file:
+            header = file.read(COMPILED_HEADER.size)
+    except FileNotFoundError:
+        return False
+    if len(header) != COMPILED_HEADER.size:
+        return False
+
+    magic, version, compiled_dtype, _, mtime_ns, size = COMPILED_HEADER.unpack(header)
+    source = os.stat(filename)
+    return (magic == COMPILED_MAGIC and version == COMPILED_VERSION
+            and compiled_dtype == dtype.encode()
+            and mtime_ns == source.st_mtime_ns and size == source.st_size)
+
+
+def load_coordinates(filename, dtype="f8", cache_dir="map_cache"):
+    """
+    Load the coordinates of a text file through its compiled binary version.
+
+    The text file stays the source of truth: it is compiled the first time it is
+    loaded and again whenever it changes. The compiled file is memory-mapped, so
+    loading does not parse text or copy the coordinates.
+
+    Args:
+        filename (str): The path to the text file containing the coordinates.
+        dtype (str, optional): The data type the coordinates are stored as, "f8" for
+            floats or "i4" for whole tile numbers (default is "f8").
+        cache_dir (str, optional): The directory compiled files are saved in
+            (default is "map_cache").
+
+    Returns:
+        ndarray: A read-only array of shape (number of coordinates, 2).
+    """
+    if not compiled_coordinates_current(filename, dtype, cache_dir):
+        compile_coordinates(filename, dtype, cache_dir)
+    return map_compiled_coordinates(compiled_coordinates_path(filename, dtype, cache_dir),
+                                    dtype)
+
+
+# Straight steps come first, and diagonal steps cost more than two straight ones,
+# so the route only cuts a corner where the middle of the road does
+NEIGHBOUR_STEPS = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1))
+DIAGONAL_STEP_LENGTH = 2.5
+
+
+def road_clearance(road):
+    """
+    Work out how far each road tile is from the edge of the road.
+
+    A tile's clearance is the number of times the road can be shrunk by one tile
+    on every side (including diagonally) before the tile is gone, so the tiles next
+    to the edge have a clearance of 1 and the middle of the road has the highest.
+    Tiles outside the map count as copies of the nearest tile on its edge, so the
+    road keeps its middle where it leaves the map.
+
+    Args:
+        road (ndarray): A (height, width) array that is True on the road tiles.
+
+    Returns:
+        ndarray: The clearance of each tile, 0 off the road.
+    """
+    height, width = road.shape
+    clearance = np.zeros(road.shape, dtype=int)
+    remaining = road.copy()
+    while remaining.any():
+        clearance += remaining
+        padded = np.pad(remaining, 1, mode="edge")
+        for dy in range(3):
+            for dx in range(3):
+                remaining &= padded[dy:dy + height, dx:dx + width]
+    return clearance
+
+
+def road_ends(road):
+    """
+    Group the road tiles on the edge of the map into the places the road leaves it.
+
+    Args:
+        road (ndarray): A (height, width) array that is True on the road tiles.
+
+    Returns:
+        list: One set of (x, y) tiles for each place the road leaves the map.
+    """
+    height, width = road.shape
+    edge_tiles = {(x, y) for y, x in zip(*np.nonzero(road))
+                  if x in (0, width - 1) or y in (0, height - 1)}
+    ends = []
+    while edge_tiles:
+        tile = min(edge_tiles)
+        end, stack = set(), [tile]
+        edge_tiles.remove(tile)
+        while stack:
+            x, y = stack.pop()
+            end.add((x, y))
+            for dx, dy in NEIGHBOUR_STEPS:
+                if (x + dx, y + dy) in edge_tiles:
+                    edge_tiles.remove((x + dx, y + dy))
+                    stack.append((x + dx, y + dy))
+        ends.append(end)
+    return ends
+
+
+def middle_paths(road, clearance, start):
+    """
+    Find the paths along the middle of a road from its start to every road tile.
+
+    Every step away from the middle of the road costs more than any path length, so
+    the paths keep to the middle first and are as short as possible second.
+
+    Args:
+        road (ndarray): A (height, width) array that is True on the road tiles.
+        clearance (ndarray): The clearance of each tile (see road_clearance).
+        start (set): The (x, y) tiles the paths can start from.
+
+    Returns:
+        tuple: The cost of the path to each (x, y) tile the start links to, and the
+        tile before each tile on its path.
+    """
+    height, width = road.shape
+    edge_cost = DIAGONAL_STEP_LENGTH * int(road.sum()) + 1
+    top = int(clearance.max())
+
+    def tile_cost(tile):
+        return (top - clearance[tile[1], tile[0]]) * edge_cost
+
+    costs = {tile: tile_cost(tile) for tile in start}
+    previous = {}
+    queue = [(cost, tile) for tile, cost in costs.items()]
+    heapq.heapify(queue)
+    while queue:
+        cost, (x, y) = heapq.heappop(queue)
+        if cost > costs[(x, y)]:
+            continue
+        for dx, dy in NEIGHBOUR_STEPS:
+            neighbour = (x + dx, y + dy)
+            if (not (0 <= neighbour[0] < width and 0 <= neighbour[1] < height)
+                    or not road[neighbour[1], neighbour[0]]):
+                continue
+            step = DIAGONAL_STEP_LENGTH if dx and dy else 1
+            neighbour_cost = cost + step + tile_cost(neighbour)
+            if neighbour_cost < costs.get(neighbour, float("inf")):
+                costs[neighbour] = neighbour_cost
+                previous[neighbour] = (x, y)
+                heapq.heappush(queue, (neighbour_cost, neighbour))
+    return costs, previous
+
+
+def find_centerline(road_tiles, width, height):
+    """
+    Find the tiles along the middle of a road, in order from its start to its end.
+
+    The road must leave the map at its start and its end. It starts where it leaves
+    the map nearest to the first road tile, and ends where it leaves the map
+    furthest along the road from there. The centerline is the path between the two
+    that keeps as far from the edge of the road as it can (see road_clearance), and
+    is the shortest such path, so it works for roads of any width and only follows
+    one branch of a road that splits.
+
+    Args:
+        road_tiles (ndarray): The (x, y) tiles of the road.
+        width (int): The width of the map in tiles.
+        height (int): The height of the map in tiles.
+
+    Returns:
+        list: The (x, y) tiles along the middle of the road.
+
+    Raises:
+        ValueError: If the road does not leave the map at two places, or they are
+            not linked by the road.
+    """
+    road = np.zeros((height, width), dtype=bool)
+    road[road_tiles[:, 1], road_tiles[:, 0]] = True
+    clearance = road_clearance(road)
+    ends = road_ends(road)
+    if len(ends) < 2:
+        raise ValueError("The road has to leave the map at its start and at its end")
+
+    first_x, first_y = road_tiles[0]
+    start = min(ends, key=lambda end: min((x - first_x) ** 2 + (y - first_y) ** 2
+                                          for x, y in end))
+
+    costs, previous = middle_paths(road, clearance, start)
+    reached = [end for end in ends if end is not start and end & costs.keys()]
+    if not reached:
+        raise ValueError("The road does not link its start to any other place it "
+                         "leaves the map")
+    end_tiles = [min((tile for tile in end if tile in costs), key=costs.get) for end in reached]
+    tile = max(end_tiles, key=costs.get)
+
+    centerline = [tile]
+    while tile in previous:
+        tile = previous[tile]
+        centerline.append(tile)
+    centerline.reverse()
+    return centerline
+
+
+def smooth_route(points, iterations=2):
+    """
+    Round the corners of a route by cutting each corner a quarter of the way along
+    its two segments (Chaikin's algorithm). The first and last points are kept.
+
+    Args:
+        points (ndarray): The (x, y) points of the route.
+        iterations (int, optional): The number of times corners are cut (default is 2).
+
+    Returns:
+        ndarray: The (x, y) points of the smoothed route.
+    """
+    for _ in range(iterations):
+        if len(points) < 3:
+            break
+        starts, ends = points[:-1], points[1:]
+        cuts = np.empty((2 * len(starts), 2))
+        cuts[0::2] = 0.75 * starts + 0.25 * ends
+        cuts[1::2] = 0.25 * starts + 0.75 * ends
+        points = np.vstack((points[:1], cuts[1:-1], points[-1:]))
+    return points
+
+
+def resample_route(points, spacing):
+    """
+    Place points along a route at equal distances from each other.
+
+    Args:
+        points (ndarray): The (x, y) points of the route.
+        spacing (float): The distance between consecutive points.
+
+    Returns:
+        ndarray: The (x, y) points spaced along the route, starting at its first point.
+    """
+    lengths = np.hypot(*np.diff(points, axis=0).T)
+    distances = np.concatenate(([0.0], np.cumsum(lengths)))
+    targets = np.arange(int(distances[-1] / spacing) + 1) * spacing
+    return np.column_stack((np.interp(targets, distances, points[:, 0]),
+                            np.interp(targets, distances, points[:, 1])))
+
+
+def compile_route(map_file, width=50, height=36, cell_size=20, spacing=0.8,
+                  smoothing=2, cache_dir="map_cache"):
+    """
+    Work out the route the circles follow from the road tiles of a map file.
+
+    The route follows the middle of the road, one tile past each end so circles
+    enter and leave off the map, with its corners rounded. Its points are spaced
+    evenly, so a circle moving one point per step moves at the same speed along
+    the whole route.
+
+    The route is saved as a compiled binary file named after a hash of the map file
+    and of the settings, so it is only worked out again when either of them changes.
+
+    Args:
+        map_file (str): The path to the text file containing the road tiles.
+        width (int, optional): The width of the map in tiles (default is 50).
+        height (int, optional): The height of the map in tiles (default is 36).
+        cell_size (int, optional): The size of each tile in pixels (default is 20).
+        spacing (float, optional): The distance between route points in pixels
+            (default is 0.8).
+        smoothing (int, optional): The number of times corners are cut (default is 2).
+        cache_dir (str, optional): The directory compiled files are saved in
+            (default is "map_cache").
+
+    Returns:
+        ndarray: The (x, y) pixel coordinates of the route.
+
+    Raises:
+        ValueError: If no route can be found along the road (see find_centerline).
+    """
+    with open(map_file, "rb") as file:
+        map_hash = hashlib.sha256(file.read())
+    map_hash.update(repr((ROUTE_COMPILER_VERSION, width, height, cell_size,
+                          spacing, smoothing)).encode())
+    path = os.path.join(cache_dir, f"route_{map_hash.hexdigest()[:16]}.bin")
+
+    if not os.path.exists(path):
+        road_tiles = load_coordinates(map_file, dtype="i4", cache_dir=cache_dir)
+        try:
+            centerline = np.array(find_centerline(road_tiles, width, height), dtype=float)
+        except ValueError as error:
+            raise ValueError(f"{map_file}: {error}") from error
+        centerline = np.vstack((2 * centerline[:1] - centerline[1:2],
+                                centerline,
+                                2 * centerline[-1:] - centerline[-2:-1]))
+        points = smooth_route(centerline * cell_size, smoothing)
+        route_points = resample_route(points, spacing)
+        write_compiled_coordinates(path, route_points, "f8")
+    return map_compiled_coordinates(path, "f8")
+
+
+MAP_FILE = "coords.txt"
+route_cache = {}
+
+
+def load_route(map_file=MAP_FILE):
+    """
+    Return the route the circles follow, loading it the first time it is asked for.
+
+    Nothing is read when the module is imported, so tools that only import it do not
+    pay for loading the route.
+
+    Args:
+        map_file (str, optional): The path to the text file containing the road tiles
+            the route is worked out from (default is MAP_FILE).
+
+    Returns:
+        Route: The route worked out from the map file.
+    """
+    if map_file not in route_cache:
+        route_cache[map_file] = Route(compile_route(map_file))
+    return route_cache[map_file]
+
+
+ENEMY_FILE = "enemies.json"
+enemy_types_cache = {}
+
+
+def load_enemy_types(filename=ENEMY_FILE):
+    """
+    Return the stats of every enemy type, loading them the first time they are asked for.
+
+    Args:
+        filename (str, optional): The path to the JSON file listing the enemy types
+            (default is ENEMY_FILE).
+
+    Returns:
+        EnemyTypes: The stats of every enemy type.
+    """
+    if filename not in enemy_types_cache:
+        with open(filename, "r", encoding="utf8") as file:
+            enemy_types_cache[filename] = EnemyTypes(json.load(file))
+    return enemy_types_cache[filename]
+
+
+TOWER_RANGES = {
+    "basic": 200,
+    "sniper": float("inf"),
+    "machine_gun": 150,
+}
+TOWER_STATS = {
+    "basic": {"tower_range": TOWER_RANGES["basic"], "fire_rate": 800, "dps": 20},
+    "sniper": {"tower_range": TOWER_RANGES["sniper"], "fire_rate": 2000, "dps": 30},
+    "machine_gun": {"tower_range": TOWER_RANGES["machine_gun"], "fire_rate": 200, "dps": 10},
+}
+# Towers loaded from a save get weaker stats than towers placed during the game.
+# Both are kept until sweeps settle which the game should use.
+LOADED_TOWER_STATS = {
+    "basic": {"tower_range": TOWER_RANGES["basic"], "fire_rate": 1000, "dps": 10},
+    "sniper": {"tower_range": TOWER_RANGES["sniper"], "fire_rate": 2000, "dps": 20},
+    "machine_gun": {"tower_range": TOWER_RANGES["machine_gun"], "fire_rate": 200, "dps": 5},
+}
+TOWER_STATS_TABLES = {"placed": TOWER_STATS, "loaded": LOADED_TOWER_STATS}
+TOWER_PRICES = {
+    "basic": 220,
+    "sniper": 400,
+    "machine_gun": 350,
+}
+
+
+class Player:
+    """A class representing a player in the game.
+
+    Attributes:
+        money (int): The amount of money the player has.
+        health (int): The health of the player.
+        score (int): The score of the player.
+
+    Methods:
+        __init__(
+            self,
+            starting_money=650,
+            starting_health=100,
+            score=0
+        ): Initializes a new Player object.
+        deduct_money(self, amount): Deducts the specified amount of money from the player.
+        add_money(self, amount): Adds the specified amount of money to the player.
+        add_health(self, amount): Adds the specified amount to the player's health.
+        take_damage(self, amount): Reduces the player's health by the specified amount.
+        increase_score(self, amount): Increases the player's score by the specified amount.
+        is_game_over(self): Checks if the player's health is zero or below, indicating game over.
+    """
+
+    def __init__(self, starting_money=650, starting_health=100, score=0):
+        """
+        Initialize a new game instance.
+
+        Args:
+            starting_money (int): The starting amount of money for the game. Default is 650.
+            starting_health (int): The starting health for the game. Default is 100.
+            score (int): The initial score for the game. Default is 0.
+        """
+        self.money = starting_money
+        self.health = starting_health
+        self.score = score
+
+    def deduct_money(self, amount):
+        """
+        Deducts the specified amount from the player's money.
+
+        Args:
+            amount (int): The amount to be deducted.
+
+        Returns:
+            None
+        """
+        self.money -= amount
+
+    def add_money(self, amount):
+        """
+        Adds the specified amount of money to the player's balance.
+
+        Parameters:
+        - amount (int): The amount of money to add.
+
+        Returns:
+        None
+        """
+        self.money += amount
+
+    def add_health(self, amount):
+        """
+        Adds the specified amount to the player's health.
+
+        Args:
+            amount (int): The amount of health to add.
+
+        Returns:
+            None
+        """
+        self.health += amount
+
+    def take_damage(self, amount):
+        """
+        Reduces the player's health by the specified amount.
+
+        Args:
+            amount (int): The amount of damage to be taken.
+
+        Returns:
+            None
+        """
+        self.health -= amount
+
+    def increase_score(self, amount):
+        """
+        Increases the score of the game by the specified amount.
+
+        Args:
+            amount (int): The amount by which to increase the score.
+        """
+        self.score += amount
+
+    def is_game_over(self):
+        """
+        Check if the game is over.
+
+        Returns:
+            bool: True if the player's health is less than or equal to 0, False otherwise.
+        """
+        return self.health <= 0
+
+
+class GameClock:
+    """
+    The time source used by the game, in milliseconds.
+
+    Methods:
+        now(self): Returns the current time in milliseconds.
+        tick(self, elapsed_ms): Called once per simulation step of elapsed_ms milliseconds.
+    """
+
+    def now(self):
+        """
+        Returns the current time.
+
+        Returns:
+            float: The current time in milliseconds.
+        """
+        raise NotImplementedError
+
+    def tick(self, elapsed_ms):
+        """
+        Lets the clock know that a simulation step of elapsed_ms milliseconds has been run.
+
+        Args:
+            elapsed_ms (float): The length of the step in milliseconds.
+        """
+
+
+class RealTimeClock(GameClock):
+    """
+    A clock that follows the wall clock, so the game runs in real time.
+    """
+
+    def now(self):
+        """
+        Returns the current wall clock time.
+
+        Returns:
+            float: The current time in milliseconds.
+        """
+        return time.perf_counter() * 1000
+
+
+class SimulatedClock(GameClock):
+    """
+    A clock that only moves when a simulation step is run.
+
+    Every step moves the clock forward by exactly its length, so the game plays out
+    the same way no matter how fast the machine runs the steps.
+
+    Attributes:
+        time (float): The current time in milliseconds.
+    """
+
+    def __init__(self, start_time=0):
+        """
+        Initializes a SimulatedClock object.
+
+        Args:
+            start_time (float, optional): The starting time in milliseconds (default is 0).
+        """
+        self.time = start_time
+
+    def now(self):
+        """
+        Returns the current simulated time.
+
+        Returns:
+            float: The current time in milliseconds.
+        """
+        return self.time
+
+    def tick(self, elapsed_ms):
+        """
+        Moves the clock forward by the length of a simulation step.
+
+        Args:
+            elapsed_ms (float): The length of the step in milliseconds.
+        """
+        self.time += elapsed_ms
+
+
+class Route:
+    """
+    The path the circles follow, indexed by the distance travelled along it.
+
+    A circle only needs to know how far along the route it is; its position is
+    looked up from that distance in O(log n) with a binary search of the distance
+    to each route point, and interpolated between the two points around it.
+
+    Attributes:
+        points (ndarray): The (x, y) pixel coordinates of the route.
+        distances (ndarray): The distance along the route to each point, in pixels.
+        length (float): The length of the whole route in pixels.
+    """
+
+    def __init__(self, points):
+        """
+        Initializes a Route object.
+
+        Args:
+            points (array_like): The (x, y) pixel coordinates of the route.
+
+        Raises:
+            ValueError: If the route has fewer than two points.
+        """
+        self.points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if len(self.points) < 2:
+            raise ValueError("A route needs at least two points")
+        segment_lengths = np.hypot(*np.diff(self.points, axis=0).T)
+        self.distances = np.concatenate(([0.0], np.cumsum(segment_lengths)))
+        self.length = float(self.distances[-1])
+
+    def __len__(self):
+        return len(self.points)
+
+    def __getitem__(self, index):
+        return self.points[index]
+
+    def index_at(self, distance):
+        """
+        Returns the index of the last route point at or before a distance along the route.
+
+        Args:
+            distance (float or ndarray): The distance along the route in pixels.
+
+        Returns:
+            int or ndarray: The index of the route point.
+        """
+        index = np.searchsorted(self.distances, distance, side="right") - 1
+        return np.minimum(np.maximum(index, 0), len(self.points) - 1)
+
+    def position_at(self, distance):
+        """
+        Returns the position at a distance along the route.
+
+        Args:
+            distance (float or ndarray): The distance along the route in pixels.
+
+        Returns:
+            ndarray: The (x, y) pixel coordinates, one row per distance.
+        """
+        index = self.index_at(distance)
+        next_index = np.minimum(index + 1, len(self.points) - 1)
+        start = self.distances[index]
+        span = self.distances[next_index] - start
+        fraction = np.minimum(np.maximum(distance - start, 0) / np.where(span > 0, span, 1), 1)
+        start_point = self.points[index]
+        return start_point + np.asarray(fraction)[..., None] * (self.points[next_index]
+                                                                - start_point)
+
+
+class TowerCoverage:
+    """
+    The parts of the route within range of a tower.
+
+    Towers never move once placed, so the distance from a tower to every route
+    coordinate only has to be measured once. Finding a target is then a matter of
+    looking up the distances of the route coordinates the circles are on.
+
+    Attributes:
+        route (Route): The route the coverage was worked out for.
+        tower_range (float): The range the coverage was worked out for.
+        distances (ndarray): The distance from the tower to each route coordinate,
+            or infinity where the coordinate is out of range.
+    """
+
+    def __init__(self, coverage_route, center_x, center_y, tower_range):
+        """
+        Initializes a TowerCoverage object.
+
+        Args:
+            coverage_route (Route): The route the circles follow.
+            center_x (float): The x pixel coordinate of the tower's center.
+            center_y (float): The y pixel coordinate of the tower's center.
+            tower_range (float): The range of the tower.
+        """
+        self.route = coverage_route
+        self.tower_range = tower_range
+
+        points = coverage_route.points
+        distances = np.hypot(points[:, 0] - center_x, points[:, 1] - center_y)
+        in_range = distances < float(tower_range)
+        distances[~in_range] = np.inf
+        self.distances = distances
+
+    def is_valid(self, coverage_route, tower_range):
+        """
+        Check if the coverage still matches the route and range of the tower.
+
+        Args:
+            coverage_route (Route): The current route.
+            tower_range (float): The current range of the tower.
+
+        Returns:
+            bool: True if the coverage can still be used, False otherwise.
+        """
+        return self.route is coverage_route and self.tower_range == tower_range
+
+
+# What can occupy a tile of the map
+TILE_FREE, TILE_ROAD, TILE_TOWER, TILE_BLOCKED = range(4)
+
+
+class OccupancyGrid:
+    """
+    What occupies each tile of the map, stored as one byte per tile.
+
+    Checking whether a tower can go on a tile is a single lookup instead of a scan
+    of the road tiles and of every tower, so it is cheap enough to run on every
+    mouse move. Placing, selling or upgrading towers keeps the grid up to date.
+
+    Attributes:
+        width (int): The width of the map in tiles.
+        height (int): The height of the map in tiles.
+        tiles (ndarray): The occupant of each tile, indexed by [y, x], one of the
+            TILE_ values.
+    """
+
+    def __init__(self, width, height):
+        """
+        Initializes an OccupancyGrid object with every tile free.
+
+        Args:
+            width (int): The width of the map in tiles.
+            height (int): The height of the map in tiles.
+        """
+        self.width = width
+        self.height = height
+        self.tiles = np.full((height, width), TILE_FREE, dtype=np.uint8)
+
+    def get(self, x, y):
+        """
+        Returns what occupies a tile. Tiles outside the map are blocked.
+
+        Args:
+            x (int): The x grid coordinate of the tile.
+            y (int): The y grid coordinate of the tile.
+
+        Returns:
+            int: The occupant of the tile, one of the TILE_ values.
+        """
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return int(self.tiles[y, x])
+        return TILE_BLOCKED
+
+    def set(self, x, y, occupant):
+        """
+        Records what occupies a tile. Tiles outside the map are ignored.
+
+        Args:
+            x (int): The x grid coordinate of the tile.
+            y (int): The y grid coordinate of the tile.
+            occupant (int): The new occupant of the tile, one of the TILE_ values.
+        """
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.tiles[y, x] = occupant
+
+    def set_many(self, coordinates, occupant):
+        """
+        Records the same occupant for many tiles at once. Tiles outside the map are ignored.
+
+        Args:
+            coordinates (iterable): The (x, y) grid coordinates of the tiles.
+            occupant (int): The new occupant of the tiles, one of the TILE_ values.
+        """
+        tiles = np.array(list(coordinates), dtype=np.int64).reshape(-1, 2)
+        inside = ((tiles[:, 0] >= 0) & (tiles[:, 0] < self.width)
+                  & (tiles[:, 1] >= 0) & (tiles[:, 1] < self.height))
+        self.tiles[tiles[inside, 1], tiles[inside, 0]] = occupant
+
+    def is_free(self, x, y):
+        """
+        Checks whether a tower can be placed on a tile.
+
+        Args:
+            x (int): The x grid coordinate of the tile.
+            y (int): The y grid coordinate of the tile.
+
+        Returns:
+            bool: True if nothing occupies the tile, False otherwise.
+        """
+        return self.get(x, y) == TILE_FREE
+
+
+class TileCoverage:
+    """
+    The parts of the route a tower would cover from each tile of the map.
+
+    For each range, the route index ranges within range of every tile are worked
+    out for all tiles at once the first time they are needed and kept. Counting the
+    covered route coordinates of a tile is then a single array lookup, and weighing
+    every tile's coverage against per-coordinate weights is a single pass over
+    those index ranges.
+
+    Attributes:
+        route (Route): The route the coverage was worked out for.
+        cell_size (int): The size of each tile in pixels.
+        width (int): The width of the map in tiles.
+        height (int): The height of the map in tiles.
+        intervals (dict): Maps each tower range to the (tiles, starts, ends) arrays of
+            the route index ranges within range, one entry per range, where tiles
+            holds the flat tile index y * width + x and ends are exclusive.
+        counts (dict): Maps each tower range to the number of route coordinates
+            within range of each tile, indexed by [y, x].
+    """
+
+    def __init__(self, coverage_route, cell_size, width, height):
+        """
+        Initializes a TileCoverage object.
+
+        Args:
+            coverage_route (Route): The route the circles follow.
+            cell_size (int): The size of each tile in pixels.
+            width (int): The width of the map in tiles.
+            height (int): The height of the map in tiles.
+        """
+        self.route = coverage_route
+        self.cell_size = cell_size
+        self.width = width
+        self.height = height
+        self.intervals = {}
+        self.counts = {}
+
+    def intervals_for(self, tower_range):
+        """
+        Returns the route index ranges within range of each tile.
+
+        Args:
+            tower_range (float): The range of the tower.
+
+        Returns:
+            tuple: The tiles, starts and ends arrays described in intervals.
+        """
+        tower_range = float(tower_range)
+        if tower_range not in self.intervals:
+            points = self.route.points
+            num_tiles = self.width * self.height
+            if tower_range == float("inf"):
+                self.intervals[tower_range] = (np.arange(num_tiles),
+                                               np.zeros(num_tiles, dtype=np.int64),
+                                               np.full(num_tiles, len(points)))
+                return self.intervals[tower_range]
+
+            # Measure one row of tiles against the whole route at a time
+            centers = np.arange(max(self.width, self.height)) * self.cell_size
+            centers += self.cell_size // 2
+            dx_squared = (points[:, 0] - centers[:self.width, None]) ** 2
+            range_squared = tower_range ** 2
+            edges = np.zeros((self.width, len(points) + 1), dtype=np.int8)
+            tiles, starts, ends = [], [], []
+            for y in range(self.height):
+                dy_squared = (points[:, 1] - centers[y]) ** 2
+                in_range = (dx_squared + dy_squared < range_squared).view(np.int8)
+                # Find where the route enters (1) and leaves (-1) the range of each tile
+                edges[:, 0] = in_range[:, 0]
+                np.subtract(in_range[:, 1:], in_range[:, :-1], out=edges[:, 1:-1])
+                edges[:, -1] = -in_range[:, -1]
+                entry_tiles, entry_indexes = np.nonzero(edges == 1)
+                tiles.append(entry_tiles + y * self.width)
+                starts.append(entry_indexes)
+                ends.append(np.nonzero(edges == -1)[1])
+            self.intervals[tower_range] = (np.concatenate(tiles), np.concatenate(starts),
+                                           np.concatenate(ends))
+        return self.intervals[tower_range]
+
+    def counts_for(self, tower_range):
+        """
+        Returns the number of route coordinates within range of each tile.
+
+        Args:
+            tower_range (float): The range of the tower.
+
+        Returns:
+            ndarray: The counts, indexed by [y, x].
+        """
+        tower_range = float(tower_range)
+        if tower_range not in self.counts:
+            tiles, starts, ends = self.intervals_for(tower_range)
+            counts = np.bincount(tiles, weights=ends - starts,
+                                 minlength=self.width * self.height)
+            self.counts[tower_range] = counts.astype(np.int64).reshape(self.height,
+                                                                       self.width)
+        return self.counts[tower_range]
+
+    def weighted_counts(self, tower_range, weights):
+        """
+        Returns the sum of the weights of the route coordinates within range of each tile.
+
+        Args:
+            tower_range (float): The range of the tower.
+            weights (ndarray): The weight of each route coordinate.
+
+        Returns:
+            ndarray: The sums, indexed by [y, x].
+        """
+        tiles, starts, ends = self.intervals_for(tower_range)
+        cumulative = np.concatenate(([0.0], np.cumsum(weights)))
+        sums = np.bincount(tiles, weights=cumulative[ends] - cumulative[starts],
+                           minlength=self.width * self.height)
+        return sums.reshape(self.height, self.width)
+
+    def count(self, x, y, tower_range):
+        """
+        Returns the number of route coordinates a tower would cover from a tile.
+
+        Args:
+            x (int): The x grid coordinate of the tile.
+            y (int): The y grid coordinate of the tile.
+            tower_range (float): The range of the tower.
+
+        Returns:
+            int: The number of covered route coordinates, 0 outside the map.
+        """
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return int(self.counts_for(tower_range)[y, x])
+        return 0
+
+
+class Tower:
+    """
+    Represents a tower in the game.
+
+    The tower only holds gameplay state; drawing it is left to the CanvasRenderer.
+
+    Attributes:
+    - x: The x grid coordinate of the tower.
+    - y: The y grid coordinate of the tower.
+    - cell_size: The size of each cell on the map.
+    - center_x: The x pixel coordinate of the tower's center.
+    - center_y: The y pixel coordinate of the tower's center.
+    - player: The player who owns the tower.
+    - fire_rate: The rate at which the tower can fire.
+    - tower_range: The range of the tower.
+    - tower_dps: The damage per second of the tower.
+    - tower_type: The type of the tower.
+    - angle: The angle the barrel is facing in radians (None until the first shot).
+    - coverage: The parts of the route within range of the tower (None until worked out).
+    """
+
+    def __init__(self, x, y, cell_size, player,
+                 fire_rate=1000, tower_range='inf', dps=10,
+                 tower_type="basic"):
+        self.player = player
+        self.x = x
+        self.y = y
+        self.cell_size = cell_size
+        self.center_x = x * cell_size + cell_size // 2
+        self.center_y = y * cell_size + cell_size // 2
+        self.fire_rate = fire_rate
+        self.last_shot_time = float('-inf')
+        self.tower_range = tower_range
+        self.tower_dps = dps
+        self.tower_type = tower_type
+        self.angle = None
+        self.coverage = None
+
+    def rotate_tower_to_target(self, target):
+        """
+        Rotate the tower to face the target.
+
+        Parameters:
+        - target: The target to rotate the tower towards.
+        """
+        # Calculate the angle between the tower and the target
+        target_x, target_y = target.position
+        self.angle = atan2(target_y - self.center_y, target_x - self.center_x)
+
+    def can_shoot(self, current_time):
+        """
+        Check if the tower can shoot.
+
+        Parameters:
+        - current_time: The current game time in milliseconds.
+
+        Returns:
+        - True if the tower can shoot, False otherwise.
+        """
+        # Check if enough time has passed since the last shot
+        time_since_last_shot = current_time - self.last_shot_time
+
+        # Check if the time since the last shot is greater than or equal to the fire rate
+        return time_since_last_shot >= self.fire_rate
+
+    def shoot(self, closest_circle, current_time):
+        """
+        Make the tower shoot at the closest circle.
+
+        Parameters:
+        - closest_circle: The closest circle to the tower.
+        - current_time: The current game time in milliseconds.
+
+        Returns:
+        - True if the shot killed the circle, False otherwise.
+        """
+        damage_per_shot = self.tower_dps
+
+        # Rotate the tower to face the target
+        self.rotate_tower_to_target(closest_circle)  # shoots
+
+        self.last_shot_time = current_time  # Update the last shot time
+
+        closest_circle.decrease_health(damage_per_shot)
+
+        if closest_circle.health <= 0:
+            self.player.add_money(closest_circle.reward)
+            self.player.increase_score(closest_circle.score)
+            return True
+        return False
+
+    def get_coverage(self, coverage_route):
+        """
+        Returns the parts of the route within range, working them out again if the
+        route or the range of the tower has changed.
+
+        Parameters:
+        - coverage_route: The route the circles follow.
+
+        Returns:
+        - The TowerCoverage of the tower.
+        """
+        if self.coverage is None or not self.coverage.is_valid(coverage_route, self.tower_range):
+            self.coverage = TowerCoverage(coverage_route, self.center_x, self.center_y,
+                                          self.tower_range)
+        return self.coverage
+
+    def invalidate_coverage(self):
+        """
+        Forget the coverage so it is worked out again the next time it is needed.
+        """
+        self.coverage = None
+
+
+class EnemyTypes:
+    """
+    The stats of every enemy type, stored as one NumPy array per stat and indexed by
+    type id.
+
+    Circles only store their type id, so the simulation looks their stats up in
+    these small arrays instead of keeping a copy of every stat per circle.
+
+    Attributes:
+        names (list): The name of each enemy type, in type id order.
+        ids (dict): Maps each enemy type name to its type id.
+        health (ndarray): The health each enemy type starts with.
+        speed (ndarray): The distance each enemy type moves in a millisecond, in pixels.
+        reward (ndarray): The money the player gets for killing each enemy type.
+        score (ndarray): The score the player gets for killing each enemy type.
+        damage (ndarray): The damage each enemy type does to the player when it gets away.
+        radius (ndarray): The radius of each enemy type.
+    """
+
+    STATS = {"health": float, "speed": float, "reward": np.int64, "score": np.int64,
+             "damage": np.int64, "radius": np.int64}
+
+    def __init__(self, enemy_types):
+        """
+        Initializes an EnemyTypes object.
+
+        Args:
+            enemy_types (list): One dictionary per enemy type with its name and stats.
+        """
+        self.names = [enemy_type["name"] for enemy_type in enemy_types]
+        self.ids = {name: type_id for type_id, name in enumerate(self.names)}
+        for stat, dtype in self.STATS.items():
+            setattr(self, stat, np.array([enemy_type[stat] for enemy_type in enemy_types],
+                                         dtype=dtype))
+
+    def __len__(self):
+        return len(self.names)
+
+
+# The stages of a circle's life once spawned: on the route, killed and got away.
+# Circles still to spawn are only entries in the wave's spawn schedule, with no row.
+CIRCLE_ACTIVE, CIRCLE_DEAD, CIRCLE_ESCAPED = range(3)
+CIRCLE_STATE_NAMES = ("active", "dead", "escaped")
+CIRCLE_STATE_CHANGES = {
+    CIRCLE_ACTIVE: (CIRCLE_DEAD, CIRCLE_ESCAPED),
+}
+
+
+class MovingCircle:
+    """
+    Represents a moving circle in the game.
+
+    The state of every circle is kept in a CircleArrays table; a MovingCircle is a
+    handle on one row of that table. Handles are pooled by the table and reused for
+    later circles, so the generation tells apart the circles a handle has stood for.
+
+    Attributes:
+        arrays (CircleArrays): The table holding the state of the circle.
+        slot (int): The row of the circle in the table, or None once it has been removed.
+        generation (int): The number of times the handle has been handed out.
+        final_state (int): The state the circle was in when it was removed.
+    """
+
+    __slots__ = ("arrays", "slot", "generation", "final_state")
+
+    def __init__(self, arrays, slot):
+        """
+        Initializes a MovingCircle object.
+
+        Args:
+            arrays (CircleArrays): The table holding the state of the circle.
+            slot (int): The row of the circle in the table.
+        """
+        self.arrays = arrays
+        self.slot = slot
+        self.generation = 0
+        self.final_state = None
+
+    @property
+    def state(self):
+        """int: The stage of the circle's life, one of the CIRCLE_ states."""
+        if self.slot is None:
+            return self.final_state
+        return int(self.arrays.state[self.slot])
+
+    @property
+    def alive(self):
+        """bool: Whether the circle is still on the route."""
+        return self.slot is not None and self.arrays.state[self.slot] == CIRCLE_ACTIVE
+
+    @property
+    def enemy_type(self):
+        """int: The type id of the circle."""
+        return int(self.arrays.enemy_type[self.slot])
+
+    @property
+    def radius(self):
+        """int: The radius of the circle."""
+        return int(self.arrays.enemy_types.radius[self.arrays.enemy_type[self.slot]])
+
+    @property
+    def health(self):
+        """float: The health of the circle."""
+        return float(self.arrays.health[self.slot])
+
+    @property
+    def distance(self):
+        """float: The distance the circle has travelled along the route in pixels."""
+        return float(self.arrays.distance[self.slot])
+
+    @distance.setter
+    def distance(self, distance):
+        self.arrays.distance[self.slot] = distance
+
+    @property
+    def speed(self):
+        """float: The distance the circle moves in a millisecond, in pixels."""
+        return float(self.arrays.enemy_types.speed[self.arrays.enemy_type[self.slot]])
+
+    @property
+    def reward(self):
+        """int: The money the player gets for killing the circle."""
+        return int(self.arrays.enemy_types.reward[self.arrays.enemy_type[self.slot]])
+
+    @property
+    def score(self):
+        """int: The score the player gets for killing the circle."""
+        return int(self.arrays.enemy_types.score[self.arrays.enemy_type[self.slot]])
+
+    @property
+    def damage(self):
+        """int: The damage the circle does to the player when it gets away."""
+        return int(self.arrays.enemy_types.damage[self.arrays.enemy_type[self.slot]])
+
+    @property
+    def position(self):
+        """tuple: The (x, y) coordinates of the circle's position."""
+        x, y = self.arrays.route.position_at(self.arrays.distance[self.slot])
+        return float(x), float(y)
+
+    @property
+    def x(self):
+        """float: The x-coordinate of the circle's position."""
+        return self.position[0]
+
+    @property
+    def y(self):
+        """float: The y-coordinate of the circle's position."""
+        return self.position[1]
+
+    def get_circle_colour(self):
+        """
+        Returns the colour of the circle based on the share of its health it has left.
+
+        Returns:
+            str: The colour of the circle.
+        """
+        max_health = self.arrays.enemy_types.health[self.arrays.enemy_type[self.slot]]
+        health = self.health * 100 / max_health
+        if health > 75:
+            return "green"
+        if health > 50:
+            return "yellow"
+        if health > 25:
+            return "orange"
+        return "red"
+
+    def decrease_health(self, damage):
+        """
+        Decreases the health of the circle by the specified amount.
+
+        Args:
+            damage (int): The amount of damage to be applied.
+        """
+        self.arrays.health[self.slot] -= damage
+
+
+class CircleArrays:
+    """
+    The state of every circle in a wave, stored as one NumPy array per field.
+
+    Keeping the state in contiguous arrays lets the simulation move every circle
+    with a single array operation and measure every tower against every circle at
+    once. Rows 0 to count - 1 are in use; removing a circle moves the last row into
+    its place, so removal takes constant time however many circles there are.
+    Removed handles are kept and handed out again for new circles, so a wave does
+    not allocate new objects.
+
+    Attributes:
+        route (Route): The route the circles follow.
+        enemy_types (EnemyTypes): The stats of every enemy type.
+        count (int): The number of rows in use.
+        distance (ndarray): The distance each circle has travelled along the route.
+        enemy_type (ndarray): The type id of each circle.
+        health (ndarray): The health of each circle.
+        state (ndarray): The stage of each circle's life, one of the CIRCLE_ states.
+        circles (list): The MovingCircle handle of each row, in row order.
+    """
+
+    def __init__(self, arrays_route, enemy_types, capacity=64):
+        """
+        Initializes a CircleArrays object.
+
+        Args:
+            arrays_route (Route): The route the circles follow.
+            enemy_types (EnemyTypes): The stats of every enemy type.
+            capacity (int, optional): The number of rows to allocate up front (default is 64).
+        """
+        self.route = arrays_route
+        self.enemy_types = enemy_types
+        self.count = 0
+        self.distance = np.zeros(capacity, dtype=float)
+        self.enemy_type = np.zeros(capacity, dtype=np.int64)
+        self.health = np.zeros(capacity, dtype=float)
+        self.state = np.zeros(capacity, dtype=np.int8)
+        self.circles = []
+        self._free_handles = []
+
+    def add(self, enemy_type=0):
+        """
+        Adds a circle at the start of the route.
+
+        Args:
+            enemy_type (int, optional): The type id of the circle (default is 0).
+
+        Returns:
+            MovingCircle: The handle of the new circle.
+        """
+        if self.count == len(self.distance):
+            self.grow()
+        slot = self.count
+        self.distance[slot] = 0
+        self.enemy_type[slot] = enemy_type
+        self.health[slot] = self.enemy_types.health[enemy_type]
+        self.state[slot] = CIRCLE_ACTIVE
+        if self._free_handles:
+            circle = self._free_handles.pop()
+            circle.slot = slot
+            circle.generation += 1
+        else:
+            circle = MovingCircle(self, slot)
+        self.circles.append(circle)
+        self.count += 1
+        return circle
+
+    def grow(self):
+        """
+        Doubles the number of rows allocated.
+        """
+        capacity = len(self.distance) * 2
+        for name in ("distance", "enemy_type", "health", "state"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def set_state(self, circle, state):
+        """
+        Moves a circle on to the next stage of its life.
+
+        Args:
+            circle (MovingCircle): The circle.
+            state (int): The new state, one of the CIRCLE_ states.
+
+        Raises:
+            ValueError: If the circle cannot go from its current state to the new one.
+        """
+        current = circle.state
+        if state not in CIRCLE_STATE_CHANGES.get(current, ()):
+            raise ValueError(f"A {CIRCLE_STATE_NAMES[current]} circle cannot become "
+                             f"{CIRCLE_STATE_NAMES[state]}")
+        self.state[circle.slot] = state
+
+    def set_states(self, slots, state):
+        """
+        Moves many circles on to the same next stage of their life at once.
+
+        Args:
+            slots (ndarray): The rows of the circles.
+            state (int): The new state, one of the CIRCLE_ states.
+
+        Raises:
+            ValueError: If any of the circles cannot go from its current state to the new one.
+        """
+        if not len(slots):
+            return
+        current = self.state[slots]
+        allowed = [before for before, after in CIRCLE_STATE_CHANGES.items() if state in after]
+        invalid = current[~np.isin(current, allowed)]
+        if len(invalid):
+            raise ValueError(f"A {CIRCLE_STATE_NAMES[invalid[0]]} circle cannot become "
+                             f"{CIRCLE_STATE_NAMES[state]}")
+        self.state[slots] = state
+
+    def remove(self, circle):
+        """
+        Removes a circle by moving the last row into its place. The handle keeps
+        the state the circle ended in until it is handed out again.
+
+        Removing a circle that has already been removed does nothing.
+
+        Args:
+            circle (MovingCircle): The circle to remove.
+
+        Raises:
+            ValueError: If the circle is still active.
+        """
+        slot = circle.slot
+        if slot is None:
+            return
+        if self.state[slot] not in (CIRCLE_DEAD, CIRCLE_ESCAPED):
+            raise ValueError(f"A {CIRCLE_STATE_NAMES[self.state[slot]]} circle cannot be removed")
+        circle.final_state = int(self.state[slot])
+        last = self.count - 1
+        if slot != last:
+            self.distance[slot] = self.distance[last]
+            self.enemy_type[slot] = self.enemy_type[last]
+            self.health[slot] = self.health[last]
+            self.state[slot] = self.state[last]
+            moved = self.circles[last]
+            moved.slot = slot
+            self.circles[slot] = moved
+        self.circles.pop()
+        self.count = last
+        circle.slot = None
+        self._free_handles.append(circle)
+
+    def active_slots(self):
+        """
+        Returns the rows of the circles currently on the route.
+
+        Returns:
+            ndarray: The row numbers.
+        """
+        return np.flatnonzero(self.state[:self.count] == CIRCLE_ACTIVE)
+
+
+class Simulation:
+    """
+    A headless engine that runs the Tower Defense Game.
+
+    The simulation owns the player, the towers, the circles and the waves, and
+    advances all of them one step at a time. It never touches Tkinter, so it can
+    be drawn by the Game window or run on its own without a display.
+
+    Attributes:
+        route (Route): The route the circles follow.
+        enemy_types (EnemyTypes): The stats of every enemy type.
+        player (Player): The player defending against the waves.
+        cell_size (int): The size of each cell in the game map.
+        towers (list): A list to store the towers in the game.
+        occupancy (OccupancyGrid): What occupies each tile of the map.
+        tile_coverage (TileCoverage): How much of the route a tower would cover from each tile.
+        circles (list): The circles currently on the route, in the row order of circle_arrays.
+        spawns (iterator): The (time, enemy type) spawns of the current wave still to
+            come, with times in milliseconds since the wave started.
+        circle_arrays (CircleArrays): The state of every circle in the wave.
+        current_wave (int): The current wave number.
+        num_circles_per_wave (list): A list of the number of circles per wave.
+        step_ms (float): The number of milliseconds a single step represents.
+        delay_between_circles (int): The time between two circles spawning in milliseconds.
+        time_between_waves (int): The time between waves in milliseconds.
+        running (bool): A flag indicating whether the waves are running.
+        clock (GameClock): The clock used for fire rates, spawning, waves and movement.
+        on_new_wave (callable): Called with the wave number when a wave starts.
+        on_game_over (callable): Called once when the player runs out of health.
+        on_circle_killed (callable): Called with each circle a tower kills, once the
+            reward has been paid.
+        on_circle_escaped (callable): Called with each circle that gets away, once the
+            player has taken the damage.
+    """
+
+    def __init__(self, simulation_route=None, player=None, cell_size=20, clock=None,
+                 enemy_types=None, map_width=50, map_height=36, map_file=MAP_FILE):
+        """
+        Initializes a Simulation object.
+
+        Args:
+            simulation_route (Route or list, optional): The route the circles follow,
+                or its (x, y) pixel coordinates (default is the route of the map file).
+            player (Player, optional): The player (default is a new Player).
+            cell_size (int, optional): The size of each cell in the game map (default is 20).
+            clock (GameClock, optional): The clock of the game (default is a SimulatedClock).
+            enemy_types (EnemyTypes, optional): The stats of every enemy type
+                (default is the enemy types loaded by load_enemy_types).
+            map_width (int, optional): The width of the map in tiles (default is 50).
+            map_height (int, optional): The height of the map in tiles (default is 36).
+            map_file (str, optional): The file with the road tiles of the map, which
+                are marked on the occupancy grid (default is MAP_FILE). With None no
+                tiles are marked and a route must be given.
+        """
+        if simulation_route is None:
+            simulation_route = load_route(map_file)
+        elif not isinstance(simulation_route, Route):
+            simulation_route = Route(simulation_route)
+        self.route = simulation_route
+        self.enemy_types = load_enemy_types() if enemy_types is None else enemy_types
+        self.player = Player() if player is None else player
+        self.cell_size = cell_size
+        self.towers = []
+        self.occupancy = OccupancyGrid(map_width, map_height)
+        if map_file is not None:
+            self.occupancy.set_many(load_coordinates(map_file, dtype="i4").tolist(), TILE_ROAD)
+        self.tile_coverage = TileCoverage(self.route, cell_size, map_width, map_height)
+        self.spawns = iter(())
+        self.circle_arrays = CircleArrays(self.route, self.enemy_types)
+
+        # these are the waves
+        self.current_wave = 0
+        self.num_circles_per_wave = [
+            5 + 5 * i
+            for i in range(100)
+        ]
+        self.step_ms = 20
+        self.delay_between_circles = 400
+        self.time_between_waves = 1000  # 1 second between waves
+        self.running = False
+        self.clock = SimulatedClock() if clock is None else clock
+
+        self.on_new_wave = None
+        self.on_game_over = None
+        self.on_circle_killed = None
+        self.on_circle_escaped = None
+
+        self._last_step_time = 0
+        self._wave_start_time = 0
+        self._next_spawn = None
+        self._next_wave_time = 0
+        self._tower_distances = None
+        self._tower_coverages = ()
+
+    @property
+    def circles(self):
+        """list: The circles currently on the route, in the row order of circle_arrays."""
+        return self.circle_arrays.circles
+
+    @property
+    def wave_cleared(self):
+        """bool: Whether every circle of the current wave has spawned and been removed."""
+        return self._next_spawn is None and not self.circles
+
+    def add_tower(self, x, y, **tower_stats):
+        """
+        Creates a tower at the given grid coordinates, adds it to the simulation and
+        marks its tile as taken.
+
+        Args:
+            x (int): The x grid coordinate of the tower.
+            y (int): The y grid coordinate of the tower.
+            **tower_stats: The fire_rate, tower_range, dps and tower_type of the tower.
+
+        Returns:
+            Tower: The new tower.
+
+        Raises:
+            ValueError: If the tile is not free to build on.
+        """
+        if not self.occupancy.is_free(x, y):
+            raise ValueError(f"Tile ({x}, {y}) is not free to build a tower on")
+        tower = Tower(x, y, self.cell_size, self.player, **tower_stats)
+        tower.get_coverage(self.route)  # Towers never move, so work this out once
+        self.towers.append(tower)
+        self.occupancy.set(x, y, TILE_TOWER)
+        return tower
+
+    def new_wave(self):
+        """
+        Increments the wave counter and starts the spawn schedule of the new wave.
+        """
+        if self.player.is_game_over():
+            return
+        if not self.running:
+            self._last_step_time = self.clock.now()
+            self.running = True
+        self.current_wave += 1
+        self._wave_start_time = self.clock.now()
+        self.spawns = self.wave_spawns(self.current_wave)
+        self._next_spawn = next(self.spawns, None)
+        # Called last, so a step run while the callback is busy sees the new wave
+        if self.on_new_wave:
+            self.on_new_wave(self.current_wave)
+
+    def wave_spawns(self, wave):
+        """
+        Generates the spawns of a wave in order, one at a time.
+
+        Circles are only created when they spawn, so a wave does not hold rows or
+        canvas items for circles that are not on the route yet.
+
+        Args:
+            wave (int): The wave number.
+
+        Yields:
+            tuple: The time of the spawn in milliseconds since the wave started, and
+            the name of the enemy type to spawn.
+        """
+        for number in range(self.num_circles_per_wave[wave - 1]):
+            yield number * self.delay_between_circles, "basic"
+
+    def spawn_circle(self, enemy_type="basic"):
+        """
+        Creates a circle at the start of the route.
+
+        Args:
+            enemy_type (str, optional): The name of the enemy type of the circle
+                (default is "basic").
+
+        Returns:
+            MovingCircle: The new circle.
+        """
+        return self.circle_arrays.add(self.enemy_types.ids[enemy_type])
+
+    def step(self):
+        """
+        Advances the whole game by one step of step_ms milliseconds.
+        """
+        if not self.running:
+            return
+
+        self.clock.tick(self.step_ms)
+        now = self.clock.now()
+        elapsed = now - self._last_step_time
+        self._last_step_time = now
+
+        if self._next_spawn is not None or self.circles:
+            self.spawn_circles(now)
+            self.move_circles(elapsed)
+            self.update_towers(now)
+            self.check_wave_completion(now)
+        elif now >= self._next_wave_time:
+            self.new_wave()
+
+    def spawn_circles(self, now):
+        """
+        Spawns the circles of the wave whose spawn time has come.
+
+        Args:
+            now (float): The current game time in milliseconds.
+        """
+        while (self._next_spawn is not None
+               and now >= self._wave_start_time + self._next_spawn[0]):
+            self.spawn_circle(self._next_spawn[1])
+            self._next_spawn = next(self.spawns, None)
+
+    def move_circles(self, elapsed):
+        """
+        Moves every circle along the route by the distance covered in the elapsed time,
+        damaging the player for each circle that reaches the end.
+
+        Args:
+            elapsed (float): The time since the last step in milliseconds.
+        """
+        arrays = self.circle_arrays
+        count = arrays.count
+        distance = arrays.distance[:count]
+        active = arrays.state[:count] == CIRCLE_ACTIVE
+        speed = self.enemy_types.speed[arrays.enemy_type[:count]]
+        np.add(distance, speed * elapsed, out=distance, where=active)
+
+        # The circles that have gone past the end of the path get away
+        escaped = np.flatnonzero(active & (distance > self.route.length))
+        arrays.set_states(escaped, CIRCLE_ESCAPED)
+        for circle in [arrays.circles[slot] for slot in escaped]:
+            self.player.take_damage(circle.damage)
+            if self.on_circle_escaped:
+                self.on_circle_escaped(circle)
+            self.remove_circle(circle)
+
+    def tower_distances(self):
+        """
+        Returns the distance from every tower to every route coordinate.
+
+        The table is rebuilt whenever a tower is added or its coverage changes.
+
+        Returns:
+            ndarray: One row per tower, one column per route coordinate, with infinity
+            where the coordinate is out of the tower's range.
+        """
+        coverages = tuple(tower.get_coverage(self.route) for tower in self.towers)
+        if self._tower_distances is None or coverages != self._tower_coverages:
+            self._tower_distances = np.vstack([coverage.distances for coverage in coverages])
+            self._tower_coverages = coverages
+        return self._tower_distances
+
+    def best_tile(self, tower_range, fire_rate, dps):
+        """
+        Suggests a free tile for a new tower, using coverage of the route penalised
+        for the damage the towers already placed deal there.
+
+        Each route coordinate a tower would cover counts for the share of the damage
+        on it the new tower would deal: r / (R + r), where r is the damage rate (dps
+        per fire_rate) of the new tower and R the sum of the damage rates of the towers
+        already covering it. Stretches of the route that little damage reaches are
+        preferred. This is a heuristic: it does not model how much health circles have
+        left when they reach each stretch.
+
+        Args:
+            tower_range (float): The range of the new tower.
+            fire_rate (float): The time between two shots of the new tower in milliseconds.
+            dps (float): The damage of each shot of the new tower.
+
+        Returns:
+            tuple: The (x, y) grid coordinates of the best tile, or None if no free
+            tile covers any of the route, or if every free tile scores the same, as
+            for a tower with infinite range.
+        """
+        damage_rate = dps / fire_rate
+        if self.towers:
+            tower_rates = np.array([tower.tower_dps / tower.fire_rate for tower in self.towers])
+            covered = np.isfinite(self.tower_distances())
+            route_rates = tower_rates @ covered
+        else:
+            route_rates = np.zeros(len(self.route))
+        scores = self.tile_coverage.weighted_counts(tower_range,
+                                                    damage_rate / (route_rates + damage_rate))
+        free_scores = scores[self.occupancy.tiles == TILE_FREE]
+        if not len(free_scores) or free_scores.max() <= 0:
+            return None
+        if free_scores.min() == free_scores.max():
+            return None  # Every free tile is as good as any other
+        scores[self.occupancy.tiles != TILE_FREE] = -1
+        y, x = np.unravel_index(scores.argmax(), scores.shape)
+        return int(x), int(y)
+
+    def update_towers(self, now):
+        """
+        Update the towers by finding the closest circle and shooting at it if possible.
+
+        The distances from every tower that is ready to shoot to every circle are
+        looked up in one go, then the towers shoot in order.
+
+        Args:
+            now (float): The current game time in milliseconds.
+        """
+        ready = [index for index, tower in enumerate(self.towers) if tower.can_shoot(now)]
+        slots = self.circle_arrays.active_slots()
+        if not ready or not len(slots):
+            return
+
+        circle_indexes = self.route.index_at(self.circle_arrays.distance[slots])
+        distances = self.tower_distances()[np.ix_(ready, circle_indexes)]
+        closest = distances.argmin(axis=1)
+
+        killed = []
+        is_killed = np.zeros(len(slots), dtype=bool)
+        for row, tower_index in enumerate(ready):
+            column = closest[row]
+            if distances[row, column] == np.inf:
+                continue  # No circle in range
+            if is_killed[column]:
+                # The target was killed by an earlier tower, pick the next closest
+                column = distances[row].argmin()
+                if distances[row, column] == np.inf:
+                    continue
+
+            circle = self.circle_arrays.circles[slots[column]]
+            if self.towers[tower_index].shoot(circle, now):
+                self.circle_arrays.set_state(circle, CIRCLE_DEAD)
+                if self.on_circle_killed:
+                    self.on_circle_killed(circle)
+                killed.append(column)
+                is_killed[column] = True
+                distances[:, column] = np.inf
+
+        # Remove the dead circles once every tower has shot, as removing moves rows
+        for circle in [self.circle_arrays.circles[slots[column]] for column in killed]:
+            self.remove_circle(circle)
+
+    def remove_circle(self, circle):
+        """
+        Removes a dead or escaped circle from the game in constant time.
+
+        Args:
+            circle (MovingCircle): The circle to remove.
+        """
+        self.circle_arrays.remove(circle)
+
+    def check_wave_completion(self, now):
+        """
+        Stops the game if the player has lost, or starts the countdown to the next wave
+        once every circle of the current wave has been killed or got away.
+
+        Args:
+            now (float): The current game time in milliseconds.
+        """
+        if self.player.is_game_over():
+            self.running = False
+            if self.on_game_over:
+                self.on_game_over()
+        elif self.wave_cleared:
+            self._next_wave_time = now + self.time_between_waves
+
+
+def layout_wave(layout):
+    """
+    Returns the wave a layout starts from.
+
+    A layout saved before the game was started has a current wave of 0, and starts
+    from the first wave.
+
+    Args:
+        layout (dict): The towers, player and current wave, in the same format as save.json.
+
+    Returns:
+        int: The number of the first wave to play.
+    """
+    return max(layout['current_wave'], 1)
+
+
+def check_layout(layout, simulation, tower_stats=None):
+    """
+    Checks that a layout can be played.
+
+    Args:
+        layout (dict): The towers, player and current wave, in the same format as save.json.
+        simulation (Simulation): The simulation to play it in, whose map and waves
+            the layout is checked against.
+        tower_stats (dict, optional): The stats of each tower type (default is TOWER_STATS).
+
+    Raises:
+        ValueError: If the player has no health left, the current wave is negative or
+            past the waves of the simulation, or a tower has an unknown type or is not
+            on a free tile.
+    """
+    tower_stats = TOWER_STATS if tower_stats is None else tower_stats
+    if layout['player']['health'] <= 0:
+        raise ValueError('The player has no health left')
+    if (layout['current_wave'] < 0
+            or layout_wave(layout) > len(simulation.num_circles_per_wave)):
+        raise ValueError(f'There is no wave {layout["current_wave"]}')
+    planned = set()
+    for tower_info in layout['towers']:
+        if tower_info['type'] not in tower_stats:
+            raise ValueError(f'Unknown tower type: {tower_info["type"]}')
+        tile = tuple(tower_info['coordinates'])
+        if tile in planned or not simulation.occupancy.is_free(*tile):
+            raise ValueError(f'Tile {tile} is not free to build a tower on')
+        planned.add(tile)
+
+
+def simulate_layout(layout, waves, tower_stats=None, tower_prices=None, enemy_types=None,
+                    num_circles_per_wave=None):
+    """
+    Plays a layout for a number of waves without a window.
+
+    The simulation runs on a SimulatedClock, so the same layout always plays out
+    the same way, as fast as the machine can run it.
+
+    Args:
+        layout (dict): The towers, player and current wave, in the same format as save.json.
+        waves (int): The number of waves to play, starting from the current wave
+            (see layout_wave).
+        tower_stats (dict, optional): The stats of each tower type (default is TOWER_STATS).
+        tower_prices (dict, optional): The price of each tower type. When given, the
+            towers of the layout are a build order: each one is bought as soon as the
+            player can afford it, instead of all being on the map from the start.
+        enemy_types (EnemyTypes, optional): The stats of every enemy type
+            (default is the enemy types loaded by load_enemy_types).
+        num_circles_per_wave (list, optional): The number of circles in each wave
+            (default is the number the Simulation uses).
+
+    Returns:
+        dict: The number of "waves_survived" and "towers_built", and the "wave",
+        "score", "money" and "health" of the player at the end of each wave played,
+        including the wave the game was lost in.
+
+    Raises:
+        ValueError: If fewer than one wave is asked for, or the layout cannot be
+            played (see check_layout).
+    """
+    if waves < 1:
+        raise ValueError('At least one wave has to be played')
+    tower_stats = TOWER_STATS if tower_stats is None else tower_stats
+    player = Player(layout['player']['money'], layout['player']['health'],
+                    layout['player']['score'])
+    simulation = Simulation(player=player, enemy_types=enemy_types)
+    if num_circles_per_wave is not None:
+        simulation.num_circles_per_wave = num_circles_per_wave
+    check_layout(layout, simulation, tower_stats)
+    simulation.current_wave = layout_wave(layout) - 1
+    last_wave = min(simulation.current_wave + waves, len(simulation.num_circles_per_wave))
+    build_order = list(layout['towers'])
+    if tower_prices is None:
+        tower_prices = dict.fromkeys(tower_stats, 0)
+
+    curves = {"wave": [], "score": [], "money": [], "health": []}
+    simulation.new_wave()
+    while simulation.running:
+        while build_order and player.money >= tower_prices[build_order[0]['type']]:
+            tower_info = build_order.pop(0)
+            player.deduct_money(tower_prices[tower_info['type']])
+            simulation.add_tower(*tower_info['coordinates'],
+                                 **tower_stats[tower_info['type']],
+                                 tower_type=tower_info['type'])
+        simulation.step()
+        if ((simulation.wave_cleared or not simulation.running)
+                and simulation.current_wave not in curves["wave"][-1:]):
+            curves["wave"].append(simulation.current_wave)
+            curves["score"].append(int(player.score))
+            curves["money"].append(int(player.money))
+            curves["health"].append(int(player.health))
+            if simulation.current_wave >= last_wave:
+                break
+    return {"waves_survived": len(curves["wave"]) - player.is_game_over(),
+            "towers_built": len(simulation.towers), **curves}
+
+
+def simulate_layouts(layouts, waves, workers=None, tower_stats=None):
+    """
+    Plays many layouts for a number of waves, spread over a pool of processes.
+
+    Args:
+        layouts (list): The layouts, in the same format as save.json.
+        waves (int): The number of waves to play.
+        workers (int, optional): The number of processes (default is one per CPU).
+            With 1 the layouts are played in this process.
+        tower_stats (dict, optional): The stats of each tower type (default is TOWER_STATS).
+
+    Returns:
+        list: The result of simulate_layout for each layout, in order.
+    """
+    if workers == 1:
+        return [simulate_layout(layout, waves, tower_stats) for layout in layouts]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(simulate_layout, layouts, [waves] * len(layouts),
+                                 [tower_stats] * len(layouts)))
+
+
+def batch_main(argv=None):
+    """
+    Plays the layouts given on the command line without a window and prints how
+    each one did.
+
+    Args:
+        argv (list, optional): The command line arguments (default is sys.argv).
+    """
+    parser = argparse.ArgumentParser(
+        prog="engine.py",
+        description="Play layouts saved like save.json without a window.")
+    parser.add_argument("layouts", nargs="+", help="the layout files to play")
+    parser.add_argument("--waves", type=int, default=10, help="the number of waves to play")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="the number of processes (default is one per CPU)")
+    parser.add_argument("--tower-stats", choices=TOWER_STATS_TABLES, default="placed",
+                        help="play with the stats of towers placed during the game "
+                             "or of towers loaded from a save (default is placed)")
+    parser.add_argument("--output", help="save the score, money and health curves as JSON")
+    args = parser.parse_args(argv)
+    if args.waves < 1:
+        parser.error("at least one wave has to be played")
+
+    layouts = []
+    for filename in args.layouts:
+        with open(filename, "r", encoding="utf8") as layout_file:
+            layouts.append(json.load(layout_file))
+        try:
+            check_layout(layouts[-1], Simulation())
+        except ValueError as error:
+            parser.error(f"{filename}: {error}")
+    results = simulate_layouts(layouts, args.waves, args.workers,
+                               TOWER_STATS_TABLES[args.tower_stats])
+
+    print(f"{'layout':<24} {'waves':>6} {'score':>8} {'money':>8} {'health':>7}")
+    for filename, result in zip(args.layouts, results):
+        score, money, health = (result[curve][-1] for curve in ("score", "money", "health"))
+        print(f"{filename:<24} {result['waves_survived']:>6} {score:>8} {money:>8} {health:>7}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as output_file:
+            json.dump(dict(zip(args.layouts, results)), output_file)
+
+
+if __name__ == "__main__":
+    batch_main()
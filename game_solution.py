@@ -3,9 +3,10 @@ This module contains the implementation of a Tower Defense Game.
 Laurentiu Cristian Preda
 initial commit: 09-11-2023
 """
-import ast
+import hashlib
 import json
-import time
+import os
+import sys
 from tkinter import Tk
 from tkinter import (
     Menu as TkMenu,
@@ -17,31 +18,60 @@ from tkinter import (
     messagebox,
     PhotoImage
 )
-from math import hypot, atan2, cos, sin
-from PIL import Image, ImageTk
+from math import cos, sin, ceil, pi
+import numpy as np
+from PIL import Image, ImageDraw, ImageTk
+from engine import (
+    LOADED_TOWER_STATS,
+    MAP_FILE,
+    TILE_FREE,
+    TILE_ROAD,
+    TILE_TOWER,
+    TOWER_PRICES,
+    TOWER_RANGES,
+    TOWER_STATS,
+    Player,
+    RealTimeClock,
+    Simulation,
+    batch_main,
+    layout_wave,
+    load_coordinates,
+    load_route
+)
 # ---All functions go here---
 
 
-def read_coordinates(filename):
+TOWER_IMAGE_FILES = {
+    "basic": "basic.png",
+    "sniper": "sniper.png",
+    "machine_gun": "machine_gun.png",
+}
+tower_image_cache = {}
+
+
+def load_tower_image(tower_type, rotation=0):
     """
-    Read coordinates from a file and return a list of tuples.
+    Return the image of a tower type, loading it the first time it is asked for.
+
+    Every tower of the same type shares the same image, so placing or loading many
+    towers does not decode the image files again. A Tk window must exist first.
 
     Args:
-        filename (str): The path to the file containing the coordinates.
+        tower_type (str): The type of the tower.
+        rotation (int, optional): The angle to rotate the image by, in degrees
+            counterclockwise (default is 0).
 
     Returns:
-        list: A list of tuples representing the coordinates.
+        PhotoImage: The image of the tower.
     """
-    coordinates = []
-    with open(filename, 'r', encoding="utf8") as file:
-        for line in file:
-            x, y = map(float, line.replace(
-                '(', '').replace(')', '').split(','))
-            coordinates.append((x, y))
-    return coordinates
-
-
-route = read_coordinates('route.txt')
+    key = (tower_type, rotation % 360)
+    if key not in tower_image_cache:
+        if key[1] == 0:
+            tower_image_cache[key] = PhotoImage(file=TOWER_IMAGE_FILES[tower_type])
+        else:
+            with Image.open(TOWER_IMAGE_FILES[tower_type]) as image:
+                tower_image_cache[key] = ImageTk.PhotoImage(image.rotate(key[1]))
+    return tower_image_cache[key]
 
 
 class Leaderboard:
@@ -320,38 +350,19 @@ class MainMenu:
             self.game.player.money = save_data['player']['money']
             self.game.player.health = save_data['player']['health']
             self.game.player.score = save_data['player']['score']
-            self.game.current_wave = save_data['current_wave'] - 1
+            self.game.simulation.current_wave = layout_wave(save_data) - 1
 
             for tower_info in save_data['towers']:
                 tower_type = tower_info['type']
                 tower_x, tower_y = tower_info['coordinates']
 
-                if tower_type == 'basic':
-                    tower = Tower(self.game.canvas, 3, self.game.cell_size,
-                                  player=self.game.player,
-                                  tower_range=200,
-                                  fire_rate=1000,
-                                  tower_type="basic")
-                elif tower_type == 'sniper':
-                    tower = Tower(self.game.canvas, 3, self.game.cell_size,
-                                  player=self.game.player,
-                                  fire_rate=2000,
-                                  dps=20,
-                                  tower_type="sniper")
-                elif tower_type == 'machine_gun':
-                    tower = Tower(self.game.canvas, 3, self.game.cell_size,
-                                  player=self.game.player,
-                                  tower_range=150,
-                                  fire_rate=200,
-                                  dps=5,
-                                  tower_type="machine_gun")
-                else:
+                if tower_type not in LOADED_TOWER_STATS:
                     raise ValueError(f'Unknown tower type: {tower_type}')
+                self.game.simulation.add_tower(tower_x, tower_y,
+                                               **LOADED_TOWER_STATS[tower_type],
+                                               tower_type=tower_type)
 
-                self.game.towers.append(tower)
-                self.game.tower_coordinates[tower] = (tower_x, tower_y)
-                tower.place_image_tower(tower_x, tower_y)
-
+            self.game.renderer.draw()
             self.game.update_player_info()
 
             # Hide the main menu
@@ -364,464 +375,716 @@ class MainMenu:
             return
 
 
-class Player:
-    """A class representing a player in the game.
+class MapGenerator:
+    """
+    A class that generates and draws a map based on given parameters.
+
+    The map can either be drawn as one canvas rectangle per cell, or as a single
+    background image. The image is drawn with Pillow the first time and saved in
+    the cache directory under the hash of the coordinates file, so later runs only
+    load it.
 
     Attributes:
-        money (int): The amount of money the player has.
-        health (int): The health of the player.
-        score (int): The score of the player.
-
-    Methods:
-        __init__(
-            self,
-            starting_money=650,
-            starting_health=100,
-            score=0
-        ): Initializes a new Player object.
-        deduct_money(self, amount): Deducts the specified amount of money from the player.
-        add_money(self, amount): Adds the specified amount of money to the player.
-        add_health(self, amount): Adds the specified amount to the player's health.
-        take_damage(self, amount): Reduces the player's health by the specified amount.
-        increase_score(self, amount): Increases the player's score by the specified amount.
-        is_game_over(self): Checks if the player's health is zero or below, indicating game over.
+        master (Tk): The master widget.
+        width (int): The width of the map.
+        height (int): The height of the map.
+        cell_size (int): The size of each cell in the map.
+        canvas (Tk.Canvas): The canvas widget to draw the map on.
+        map (list): A 2D list representing the map.
+        path_coordinates (list): A list to store the coordinates of the selected path.
+        use_background_image (bool): Whether to draw the map as a single image.
+        cache_dir (str): The directory the rendered map images are saved in.
+        map_key (str): The hash identifying the map drawn, used to name its cached image.
+        map_image (PhotoImage): The background image on the canvas, if any.
     """
 
-    def __init__(self, starting_money=650, starting_health=100, score=0):
+    def __init__(self, master, width, height, cell_size, use_background_image=False,
+                 cache_dir="map_cache"):
         """
-        Initialize a new game instance.
+        Initializes a MapGenerator object.
 
         Args:
-            starting_money (int): The starting amount of money for the game. Default is 650.
-            starting_health (int): The starting health for the game. Default is 100.
-            score (int): The initial score for the game. Default is 0.
+            master (Tk): The master widget.
+            width (int): The width of the map.
+            height (int): The height of the map.
+            cell_size (int): The size of each cell in the map.
+            use_background_image (bool, optional): Whether to draw the map as a single
+                image (default is False).
+            cache_dir (str, optional): The directory the rendered map images are saved in
+                (default is "map_cache").
         """
-        self.money = starting_money
-        self.health = starting_health
-        self.score = score
+        self.master = master
+        self.width = width
+        self.height = height
+        self.cell_size = cell_size
+        self.canvas = master
+        self.canvas.pack()
 
-    def deduct_money(self, amount):
-        """
-        Deducts the specified amount from the player's money.
+        self.map = [[0 for _ in range(width)]
+                    for _ in range(height)]  # Initialize the map
+        self.path_coordinates = []  # To store the coordinates of the selected path
 
-        Args:
-            amount (int): The amount to be deducted.
+        self.use_background_image = use_background_image
+        self.cache_dir = cache_dir
+        self.map_key = None
+        self.map_image = None
+
+    def get_path_coordinates(self):
+        """
+        Returns the coordinates of the selected path.
 
         Returns:
-            None
+            list: The coordinates of the selected path.
         """
-        self.money -= amount
+        return self.path_coordinates
 
-    def add_money(self, amount):
+    def draw_map(self):
+        """
+        Draws the map on the canvas.
         """
-        Adds the specified amount of money to the player's balance.
+        if self.use_background_image:
+            self.draw_map_image()
+            return
 
-        Parameters:
-        - amount (int): The amount of money to add.
+        for y, row in enumerate(self.map):
+            for x, cell in enumerate(row):
+                # dark brown for road, green for grass
+                color = "#8B4513" if cell == 1 else "green"
+                self.canvas.create_rectangle(x * self.cell_size, y * self.cell_size,
+                                             (x + 1) * self.cell_size, (y +
+                                                                        1) * self.cell_size,
+                                             fill=color)
 
-        Returns:
-        None
+    def draw_map_from_file(self, filename):
         """
-        self.money += amount
+        Draws the map based on the coordinates provided in a file.
 
-    def add_health(self, amount):
+        Args:
+            filename (str): The path to the file containing the coordinates.
         """
-        Adds the specified amount to the player's health.
+        coordinates = load_coordinates(filename, dtype="i4", cache_dir=self.cache_dir)
 
-        Args:
-            amount (int): The amount of health to add.
+        # Set the coordinates from the file as the new path
+        for x, y in coordinates.tolist():
+            self.map[y][x] = 1
+            self.path_coordinates.append((x, y))
 
-        Returns:
-            None
-        """
-        self.health += amount
+        with open(filename, "rb") as file:
+            self.map_key = hashlib.sha256(file.read()).hexdigest()[:16]
 
-    def take_damage(self, amount):
-        """
-        Reduces the player's health by the specified amount.
+        # Redraw the updated map
+        self.draw_map()
 
-        Args:
-            amount (int): The amount of damage to be taken.
+    def render_map_image(self):
+        """
+        Draws the map into an image, one rectangle per cell like draw_map.
 
         Returns:
-            None
+            Image: The image of the map.
         """
-        self.health -= amount
-        print(f"Circle got away! Player health: {self.health}")
+        image = Image.new("RGB", (self.width * self.cell_size, self.height * self.cell_size))
+        draw = ImageDraw.Draw(image)
+        for y, row in enumerate(self.map):
+            for x, cell in enumerate(row):
+                # dark brown for road, green for grass
+                color = "#8B4513" if cell == 1 else "green"
+                draw.rectangle((x * self.cell_size, y * self.cell_size,
+                                (x + 1) * self.cell_size, (y + 1) * self.cell_size),
+                               fill=color, outline="black")
+        return image
 
-    def increase_score(self, amount):
+    def map_image_path(self):
         """
-        Increases the score of the game by the specified amount.
+        Returns the path of the cached image of the current map.
 
-        Args:
-            amount (int): The amount by which to increase the score.
-        """
-        self.score += amount
+        Maps that were not loaded from a file are identified by the hash of their cells.
 
-    def is_game_over(self):
+        Returns:
+            str: The path of the image file.
         """
-        Check if the game is over.
+        map_key = self.map_key
+        if map_key is None:
+            cells = bytes(cell for row in self.map for cell in row)
+            map_key = hashlib.sha256(cells).hexdigest()[:16]
+        return os.path.join(
+            self.cache_dir,
+            f"map_{map_key}_{self.width}x{self.height}_{self.cell_size}.png")
 
-        Returns:
-            bool: True if the player's health is less than or equal to 0, False otherwise.
+    def draw_map_image(self):
+        """
+        Draws the map on the canvas as a single image, rendering and caching it if needed.
         """
-        return self.health <= 0
+        path = self.map_image_path()
+        if not os.path.exists(path):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Saved under a temporary name first, so a half-written image is never loaded
+            temporary_path = f"{path}.{os.getpid()}.tmp"
+            self.render_map_image().save(temporary_path, format="PNG")
+            os.replace(temporary_path, path)
 
+        self.map_image = PhotoImage(file=path)
+        self.canvas.create_image(0, 0, image=self.map_image, anchor="nw")
 
-class Tower:
+
+class CanvasRenderer:
     """
-    Represents a tower in the game.
+    Draws the state of a Simulation onto a Tkinter canvas.
+
+    In batched mode, the coords, itemconfig and delete calls made while drawing a
+    frame are collected into a single Tcl script and sent to Tk in one call when the
+    frame is flushed, instead of one Tk round-trip per circle.
+
+    The ovals of circles that are gone are hidden and kept for later circles rather
+    than deleted, so waves do not create and delete hundreds of canvas items.
+    Barrels are drawn at one of a fixed number of angles and their lines are moved
+    rather than recreated, and only when the tower turns to a new angle.
 
     Attributes:
-    - canvas: The canvas on which the tower is placed.
-    - size: The size of the tower.
-    - cell_size: The size of each cell on the canvas.
-    - player: The player who owns the tower.
-    - fire_rate: The rate at which the tower can fire.
-    - tower_range: The range of the tower.
-    - tower_dps: The damage per second of the tower.
-    - tower_type: The type of the tower.
-    - tower_images: A dictionary of tower images.
-    - barrel_line_tag: The tag used to identify the barrel line on the canvas.
+        canvas (TkCanvas): The canvas to draw on.
+        simulation (Simulation): The simulation being drawn.
+        cell_size (int): The size of each cell in the game map.
+        batched (bool): A flag indicating whether canvas updates are batched per frame.
+        circle_items (dict): Maps each drawn circle to its
+            [canvas item, drawn generation, drawn health, drawn x, drawn y].
+        tower_items (dict): Maps each drawn tower to its canvas item.
+        barrel_directions (list): The (x, y) offsets of the barrel end for each of the
+            angles barrels are drawn at.
+        barrel_items (dict): Maps each drawn tower to the canvas items of its barrel.
+        barrel_steps (dict): Maps each drawn tower to the barrel direction it is drawn at.
     """
 
-    def __init__(self, canvas, size, cell_size, player,
-                 fire_rate=1000, tower_range='inf', dps=10,
-                 tower_type="basic"):
-        self.player = player
+    def __init__(self, canvas, simulation, cell_size, batched=True, barrel_angles=32):
+        """
+        Initializes a CanvasRenderer object.
+
+        Args:
+            canvas (TkCanvas): The canvas to draw on.
+            simulation (Simulation): The simulation being drawn.
+            cell_size (int): The size of each cell in the game map.
+            batched (bool, optional): Whether to batch canvas updates per frame
+                (default is True).
+            barrel_angles (int, optional): The number of angles barrels are drawn at
+                (default is 32).
+        """
         self.canvas = canvas
-        self.size = size
+        self.simulation = simulation
         self.cell_size = cell_size
-        self.tower = None
-        self.fire_rate = fire_rate
-        self.last_shot_time = 0
-        self.tower_range = tower_range
-        self.tower_dps = dps
-        self.tower_type = tower_type
-
-        # Load tower images
-        self.tower_images = {
-            "basic": PhotoImage(file="basic.png"),
-            "sniper": PhotoImage(file="sniper.png"),
-            "machine_gun": PhotoImage(file="machine_gun.png"),
-        }
+        self.batched = batched
+        self.circle_items = {}
+        self.tower_items = {}
+        barrel_length = 30  # Adjust the length as needed
+        self.barrel_directions = [
+            (barrel_length * cos(2 * pi * step / barrel_angles),
+             barrel_length * sin(2 * pi * step / barrel_angles))
+            for step in range(barrel_angles)
+        ]
+        self.barrel_items = {}
+        self.barrel_steps = {}
+        self._pending_commands = []
+        self._free_ovals = []
+
+    def move_item(self, item, *coordinates):
+        """
+        Moves a canvas item, or queues the move until the frame is flushed.
 
-        self.barrel_line_tag = f"barrel_line_{id(self)}"
+        Args:
+            item (int): The canvas item to move.
+            *coordinates (float): The new coordinates of the item.
+        """
+        if self.batched:
+            self._pending_commands.append(
+                f"{self.canvas} coords {item} " + " ".join(map(str, coordinates)))
+        else:
+            self.canvas.coords(item, *coordinates)
 
-    def rotate_tower_to_target(self, target):
+    def fill_item(self, item, colour):
         """
-        Rotate the tower to face the target.
+        Changes the fill colour of a canvas item, or queues it until the frame is flushed.
 
-        Parameters:
-        - target: The target to rotate the tower towards.
+        Args:
+            item (int): The canvas item to recolour.
+            colour (str): The new fill colour.
         """
-        tower_x, tower_y = self.canvas.coords(self.tower)[:2]
-        target_x, target_y = self.canvas.coords(target.circle)[:2]
+        if self.batched:
+            self._pending_commands.append(f"{self.canvas} itemconfigure {item} -fill {{{colour}}}")
+        else:
+            self.canvas.itemconfig(item, fill=colour)
 
-        # Calculate the angle between the tower and the target
-        angle_rad = atan2(target_y - tower_y, target_x - tower_x)
+    def set_item_state(self, item, state):
+        """
+        Shows or hides a canvas item, or queues it until the frame is flushed.
 
-        # Set the length of the barrel line
-        barrel_length = 30  # Adjust the length as needed
+        Args:
+            item (int): The canvas item.
+            state (str): "normal" to show the item or "hidden" to hide it.
+        """
+        if self.batched:
+            self._pending_commands.append(f"{self.canvas} itemconfigure {item} -state {state}")
+        else:
+            self.canvas.itemconfig(item, state=state)
 
-        # Calculate the end point of the line
-        line_end_x = tower_x + barrel_length * cos(angle_rad)
-        line_end_y = tower_y + barrel_length * sin(angle_rad)
-
-        # Draw the barrel line
-        self.canvas.delete(self.barrel_line_tag)  # Clear previous lines
-        self.canvas.create_line(tower_x, tower_y,
-                                line_end_x, line_end_y,
-                                tags=self.barrel_line_tag, width=10,
-                                fill="black")
-        self.canvas.create_line(tower_x, tower_y,
-                                line_end_x, line_end_y,
-                                tags=self.barrel_line_tag, width=8,
-                                fill="light gray")
-
-    def place_image_tower(self, x, y):
+    def flush(self):
+        """
+        Sends the queued canvas updates to Tk in a single call and redraws the canvas once.
+        """
+        if self._pending_commands:
+            self.canvas.tk.eval("\n".join(self._pending_commands))
+            self._pending_commands.clear()
+        self.canvas.update_idletasks()
+
+    def draw(self):
+        """
+        Brings the canvas in line with the current state of the simulation.
+        """
+        for tower in self.simulation.towers:
+            if tower not in self.tower_items:
+                self.place_image_tower(tower)
+            if tower.angle is not None:
+                self.draw_barrel(tower)
+
+        for circle, item in list(self.circle_items.items()):
+            if not circle.alive or item[1] != circle.generation:
+                del self.circle_items[circle]
+                self.set_item_state(item[0], "hidden")
+                self._free_ovals.append(item[0])
+
+        # Look up the positions of all the circles at once
+        circles = self.simulation.circles
+        distances = self.simulation.circle_arrays.distance[:len(circles)]
+        positions = self.simulation.route.position_at(distances).tolist()
+        for circle, (x, y) in zip(circles, positions):
+            self.draw_circle(circle, x, y)
+
+        self.flush()
+
+    def draw_circle(self, circle, x, y):
+        """
+        Creates or moves the canvas item of a circle and updates its colour.
+
+        Args:
+            circle (MovingCircle): The circle to draw.
+            x (float): The x-coordinate of the circle's position.
+            y (float): The y-coordinate of the circle's position.
+        """
+        diameter = circle.radius * 2
+        item = self.circle_items.get(circle)
+        if item is None:
+            if self._free_ovals:
+                oval = self._free_ovals.pop()
+                self.move_item(oval, x, y, x + diameter, y + diameter)
+                self.fill_item(oval, 'black')
+                self.set_item_state(oval, "normal")
+            else:
+                oval = self.canvas.create_oval(x, y, x + diameter, y + diameter,
+                                               fill='black')
+            self.circle_items[circle] = [oval, circle.generation, circle.health, x, y]
+            return
+
+        if item[3] != x or item[4] != y:
+            self.move_item(item[0], x, y, x + diameter, y + diameter)
+            item[3] = x
+            item[4] = y
+        if item[2] != circle.health:
+            self.fill_item(item[0], circle.get_circle_colour())
+            item[2] = circle.health
+
+    def place_image_tower(self, tower):
         """
         Place the tower image on the canvas.
 
-        Parameters:
-        - x: The x-coordinate of the tower.
-        - y: The y-coordinate of the tower.
+        Args:
+            tower (Tower): The tower to draw.
         """
-        tower_image = self.tower_images[self.tower_type]
+        tower_image = load_tower_image(tower.tower_type)
 
         if tower_image:
-            tower_x = x * self.cell_size + self.cell_size // 2
-            tower_y = y * self.cell_size + self.cell_size // 2
-
-            self.tower = self.canvas.create_image(tower_x, tower_y,
-                                                  image=tower_image,
-                                                  anchor="center")
+            self.tower_items[tower] = self.canvas.create_image(tower.center_x,
+                                                               tower.center_y,
+                                                               image=tower_image,
+                                                               anchor="center")
         else:
             print("No tower image found!")
 
-    def can_shoot(self):
+    def draw_barrel(self, tower):
         """
-        Check if the tower can shoot.
+        Points the barrel of the tower at the closest of the drawn angles to its
+        current angle, creating the barrel lines the first time.
 
-        Returns:
-        - True if the tower can shoot, False otherwise.
+        Args:
+            tower (Tower): The tower whose barrel to draw.
         """
-        # Check if enough time has passed since the last shot
-        current_time = time.time() * 1000  # Convert to milliseconds
-        time_since_last_shot = current_time - self.last_shot_time
+        step = round(tower.angle / (2 * pi) * len(self.barrel_directions))
+        step %= len(self.barrel_directions)
+        if self.barrel_steps.get(tower) == step:
+            return
+        self.barrel_steps[tower] = step
 
-        # Check if the time since the last shot is greater than or equal to the fire rate
-        return time_since_last_shot >= self.fire_rate
+        # Calculate the end point of the line
+        offset_x, offset_y = self.barrel_directions[step]
+        line_end_x = tower.center_x + offset_x
+        line_end_y = tower.center_y + offset_y
+
+        if tower not in self.barrel_items:
+            self.barrel_items[tower] = (
+                self.canvas.create_line(tower.center_x, tower.center_y,
+                                        line_end_x, line_end_y,
+                                        width=10, fill="black"),
+                self.canvas.create_line(tower.center_x, tower.center_y,
+                                        line_end_x, line_end_y,
+                                        width=8, fill="light gray"),
+            )
+            return
 
-    def shoot(self, closest_circle):
-        """
-        Make the tower shoot at the closest circle.
+        for line in self.barrel_items[tower]:
+            self.move_item(line, tower.center_x, tower.center_y, line_end_x, line_end_y)
 
-        Parameters:
-        - closest_circle: The closest circle to the tower.
-        """
-        # SHOOTING LOGIC HERE
-        # DECREASE ITS HEALTH UNTIL IT REACHES ZERO,
-        # THEN REMOVE IT FROM THE LIST OF CIRCLES AND CANVAS
-        damage_per_shot = self.tower_dps
 
-        # Rotate the tower to face the target
-        self.rotate_tower_to_target(closest_circle)  # shoots
+class CoverageHeatmap:
+    """
+    An overlay that colours every free tile by how much of the route a tower would
+    cover from it, from blue for the least to red for the most.
 
-        self.last_shot_time = time.time() * 1000  # Update the last shot time
+    The overlay is drawn as one semi-transparent image built from the per-tile
+    counts with NumPy, and shown in a single canvas item that is reused.
 
-        closest_circle.decrease_health(damage_per_shot)
+    Attributes:
+        canvas (TkCanvas): The canvas to draw on.
+        cell_size (int): The size of each cell in the game map.
+        item (int): The canvas item of the overlay.
+        image (ImageTk.PhotoImage): The image of the overlay (None until first shown).
+    """
 
-        if closest_circle.health <= 0:
-            self.player.add_money(20)  # EDIT PLAYER MONEY REWARD HERE
-            self.player.increase_score(100)  # EDIT PLAYER SCORE REWARD HERE
-            print(
-                f"Circle removed! Money: {self.player.money} Score: {self.player.score}")
-            closest_circle.remove_circle()
+    COLOURS = np.array([[40, 60, 220], [240, 220, 40], [220, 30, 30]], dtype=float)
 
-    def find_closest_circle(self, circles):
+    def __init__(self, canvas, cell_size):
         """
-        Find the closest circle to the tower.
+        Initializes a CoverageHeatmap object.
 
-        Parameters:
-        - circles: The list of circles to search from.
+        Args:
+            canvas (TkCanvas): The canvas to draw on.
+            cell_size (int): The size of each cell in the game map.
+        """
+        self.canvas = canvas
+        self.cell_size = cell_size
+        self.item = canvas.create_image(0, 0, anchor="nw", state="hidden")
+        self.image = None
 
-        Returns:
-        - The closest circle to the tower.
+    def show(self, counts, free):
         """
-        tower_x, tower_y = self.canvas.coords(self.tower)[:2]
+        Shows the overlay.
 
-        closest_circle = None
-        min_distance = float(self.tower_range)
+        Args:
+            counts (ndarray): The number of route coordinates covered from each tile,
+                indexed by [y, x].
+            free (ndarray): Whether each tile is free to build on, indexed by [y, x].
+        """
+        top = counts[free].max() if free.any() else 0
+        share = counts / top if top else np.zeros(counts.shape)
+        stops = np.linspace(0, 1, len(self.COLOURS))
 
-        for circle in circles:
-            try:
-                circle_x, circle_y = self.canvas.coords(
-                    circle.circle)[:2]  # Only unpack the first two values
-            except ValueError:
-                # The circle has been removed from the canvas, skip to next
-                continue
-            distance = hypot(circle_x - tower_x, circle_y - tower_y)
+        colours = np.empty(counts.shape + (4,), dtype=np.uint8)
+        for channel in range(3):
+            colours[..., channel] = np.interp(share, stops, self.COLOURS[:, channel])
+        colours[..., 3] = np.where(free, 120, 0)
+        pixels = colours.repeat(self.cell_size, axis=0).repeat(self.cell_size, axis=1)
 
-            if distance < min_distance:
-                min_distance = distance
-                closest_circle = circle
+        self.image = ImageTk.PhotoImage(Image.fromarray(pixels, "RGBA"))
+        self.canvas.itemconfig(self.item, image=self.image, state="normal")
 
-        return closest_circle
+    def hide(self):
+        """
+        Hides the overlay.
+        """
+        self.canvas.itemconfig(self.item, state="hidden")
 
 
-class MovingCircle:
+class PlacementPreview:
     """
-    Represents a moving circle in the game.
+    Shows where a tower would go while the mouse moves over the map: a ghost of the
+    tower, its range and how much of the route it would cover.
+
+    The canvas items are created once and then moved, reconfigured or hidden, so
+    mouse moves never create or delete items.
 
     Attributes:
-        canvas (object): The canvas object where the circle is drawn.
-        player (object): The player object.
-        game (object): The game object.
-        radius (int): The radius of the circle (default is 10).
-        health (int): The health of the circle (default is 100).
-        x (int): The x-coordinate of the circle's initial position (default is -100).
-        y (int): The y-coordinate of the circle's initial position (default is -100).
-        circle (object): The circle object created on the canvas.
-        current_coordinate_index (int): The index of the current coordinate in the route.
+        canvas (TkCanvas): The canvas to draw on.
+        cell_size (int): The size of each cell in the game map.
+        image_item (int): The canvas item of the ghost tower.
+        range_item (int): The canvas item of the range circle.
+        text_item (int): The canvas item of the coverage text.
+        canvas_width (int): The width of the canvas, used to keep the text on it.
+        tower_type (str): The type of tower the ghost image was last set to.
+        shown (tuple): What the preview currently shows, or None when it is hidden.
     """
 
-    def __init__(self, canvas, player, game, radius=10, health=100, x=-100, y=-100):
+    def __init__(self, canvas, cell_size):
         """
-        Initializes a MovingCircle object.
+        Initializes a PlacementPreview object.
 
         Args:
-            canvas (object): The canvas object where the circle is drawn.
-            player (object): The player object.
-            game (object): The game object.
-            radius (int, optional): The radius of the circle (default is 10).
-            health (int, optional): The health of the circle (default is 100).
-            x (int, optional): The x-coordinate of the circle's initial position (default is -100).
-            y (int, optional): The y-coordinate of the circle's initial position (default is -100).
+            canvas (TkCanvas): The canvas to draw on.
+            cell_size (int): The size of each cell in the game map.
         """
         self.canvas = canvas
-        self.radius = radius
-        self.health = health
-        self.player = player
-        self.game = game
-        self.circle = self.canvas.create_oval(
-            x, y,
-            x + radius * 2,
-            y + radius * 2,
-            fill='black'
-        )
-        self.current_coordinate_index = 0
+        self.cell_size = cell_size
+        self.range_item = canvas.create_oval(0, 0, 0, 0, width=2, dash=(4, 4),
+                                             state="hidden", tags="preview")
+        self.image_item = canvas.create_image(0, 0, anchor="center",
+                                              state="hidden", tags="preview")
+        self.text_item = canvas.create_text(0, 0, anchor="s", fill="white",
+                                            font=("Helvetica", 12, "bold"),
+                                            state="hidden", tags="preview")
+        self.canvas_width = canvas.winfo_reqwidth()
+        self.tower_type = None
+        self.shown = None
 
-    def move_circle(self, delay=20):
+    def show(self, tower_type, x, y, tower_range, valid, covered, route_length):
         """
-        Moves the circle along the predefined route.
+        Shows the preview of a tower on a tile.
 
         Args:
-            delay (int, optional): The delay between each move in milliseconds (default is 20).
-        """
-        if route:
-            if self.current_coordinate_index < len(route):
-                x, y = route[self.current_coordinate_index]
-                self.canvas.coords(
-                    self.circle,
-                    x, y,
-                    x+self.radius * 2,
-                    y+self.radius * 2
-                )
-                self.canvas.update()
-                self.current_coordinate_index += 1
-
-                if self.current_coordinate_index == len(route):
-                    # The circle has reached the end of the path, remove it
-                    if self.circle in self.canvas.find_all():
-                        self.player.take_damage(20)
-                        self.remove_circle()
-                else:
-                    # Schedule next move
-                    self.canvas.after(delay, self.move_circle)
+            tower_type (str): The type of the tower.
+            x (int): The x grid coordinate of the tile.
+            y (int): The y grid coordinate of the tile.
+            tower_range (float): The range of the tower.
+            valid (bool): Whether the tower can be placed on the tile.
+            covered (int): The number of route coordinates the tower would cover.
+            route_length (int): The number of route coordinates in the whole route.
+        """
+        if self.shown == (tower_type, x, y, valid, covered):
+            return  # Still on the same tile
+        self.shown = (tower_type, x, y, valid, covered)
+
+        center_x = x * self.cell_size + self.cell_size // 2
+        center_y = y * self.cell_size + self.cell_size // 2
+        colour = "lime green" if valid else "red"
+
+        if tower_type != self.tower_type:
+            self.canvas.itemconfig(self.image_item, image=load_tower_image(tower_type))
+            self.tower_type = tower_type
+        self.canvas.coords(self.image_item, center_x, center_y)
+
+        tower_range = float(tower_range)
+        if tower_range == float("inf"):
+            self.canvas.itemconfig(self.range_item, state="hidden")
+        else:
+            self.canvas.coords(self.range_item,
+                               center_x - tower_range, center_y - tower_range,
+                               center_x + tower_range, center_y + tower_range)
+            self.canvas.itemconfig(self.range_item, outline=colour, state="normal")
 
-    def get_circle_colour(self):
+        # Keep the text above the tower, but inside the canvas
+        text_x = min(max(center_x, 100), self.canvas_width - 100)
+        text_y = max(center_y - self.cell_size, 20)
+        self.canvas.coords(self.text_item, text_x, text_y)
+        self.canvas.itemconfig(self.text_item, fill=colour,
+                               text=f"Covers {covered} path points "
+                                    f"({100 * covered / route_length:.0f}%)")
+        self.canvas.itemconfig(self.image_item, state="normal")
+        self.canvas.itemconfig(self.text_item, state="normal")
+        self.canvas.tag_raise("preview")
+
+    def hide(self):
+        """
+        Hides the preview.
         """
-        Returns the colour of the circle based on its health.
+        for item in (self.range_item, self.image_item, self.text_item):
+            self.canvas.itemconfig(item, state="hidden")
+        self.shown = None
 
-        Returns:
-            str: The colour of the circle.
+
+class GameLoop:
+    """
+    Runs a Simulation at a fixed tick rate from a single Tk timer.
+
+    Every frame, the loop works out how much real time has passed and runs as many
+    simulation ticks as fit into it, then draws once. The number of timers stays the
+    same no matter how many circles are on the route. If the simulation falls behind
+    (for example while a message box is open), at most max_ticks_per_frame ticks are
+    run to catch up and the rest of the backlog is dropped.
+
+    The time scale speeds the game up by running more ticks per frame. When it is
+    None (max speed), ticks are run back to back for a whole frame and the canvas is
+    only drawn once per frame, so the simulation runs as fast as the machine allows.
+
+    Attributes:
+        root (Tk): The widget used to schedule frames.
+        simulation (Simulation): The simulation being advanced.
+        draw (callable): Called once at the end of every frame.
+        tick_rate (int): The number of simulation ticks per second.
+        clock (GameClock): The clock used to measure how much time has passed between frames.
+        frame_delay (int): The time between two frames in milliseconds.
+        max_ticks_per_frame (int): The maximum number of ticks run in a single frame.
+        time_scale (float): How many times faster than real time the game runs,
+            or None to run as fast as possible.
+        ticks_per_second (float): The number of ticks run during the last second.
+        running (bool): A flag indicating whether the loop is scheduled.
+        paused (bool): A flag indicating whether frames are drawn without running ticks.
+    """
+
+    def __init__(self, root, simulation, draw, tick_rate=50, frame_rate=50,
+                 max_ticks_per_frame=5, clock=None):
         """
-        if self.health > 75:
-            return "green"
-        if self.health > 50:
-            return "yellow"
-        if self.health > 25:
-            return "orange"
-        return "red"
+        Initializes a GameLoop object.
 
-    def update_circle_colour(self):
+        Args:
+            root (Tk): The widget used to schedule frames.
+            simulation (Simulation): The simulation being advanced.
+            draw (callable): Called once at the end of every frame.
+            tick_rate (int, optional): The number of simulation ticks per second (default is 50).
+            frame_rate (int, optional): The number of frames per second (default is 50).
+            max_ticks_per_frame (int, optional): The maximum number of ticks run in a single
+                frame (default is 5).
+            clock (GameClock, optional): The clock used to measure frames
+                (default is a RealTimeClock).
         """
-        Updates the circle colour based on current health.
+        self.root = root
+        self.simulation = simulation
+        self.draw = draw
+        self.tick_rate = tick_rate
+        self.clock = RealTimeClock() if clock is None else clock
+        self.frame_delay = max(1, round(1000 / frame_rate))
+        self.max_ticks_per_frame = max_ticks_per_frame
+        self.time_scale = 1
+        self.ticks_per_second = 0
+        self.running = False
+        self.paused = False
+
+        self.simulation.step_ms = 1000 / tick_rate
+        self._accumulator = 0
+        self._last_frame_time = 0
+        self._after_id = None
+        self._throughput_start = 0
+        self._throughput_ticks = 0
+
+    def set_time_scale(self, time_scale):
+        """
+        Changes how fast the game runs.
+
+        Args:
+            time_scale (float): How many times faster than real time the game runs,
+                or None to run as fast as possible.
         """
-        self.canvas.itemconfig(self.circle, fill=self.get_circle_colour())
+        self.time_scale = time_scale
+        self._accumulator = 0
 
-    def remove_circle(self):
+    def start(self):
         """
-        Removes the circle from the canvas and updates the game state.
+        Starts scheduling frames.
         """
-        self.canvas.delete(self.circle)
-        self.canvas.update()
-        self.current_coordinate_index = 0
+        if self.running:
+            return
+        self.running = True
+        self._accumulator = 0
+        self._last_frame_time = self.clock.now()
+        self._throughput_start = self._last_frame_time
+        self._throughput_ticks = 0
+        self._after_id = self.root.after(self.frame_delay, self.run_frame)
 
-        if self in self.game.circles:
-            self.game.circles.remove(self)
+    def stop(self):
+        """
+        Stops scheduling frames.
+        """
+        self.running = False
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+            self._after_id = None
 
-    def decrease_health(self, damage):
+    def pause(self):
         """
-        Decreases the health of the circle by the specified amount and updates the circle colour.
+        Stops running ticks, for example while a message box is open.
+        Frames are still scheduled, so the loop picks up again on resume.
+        """
+        self.paused = True
 
-        Args:
-            damage (int): The amount of damage to be applied.
+    def resume(self):
+        """
+        Runs ticks again, without catching up on the time spent paused.
         """
-        self.health -= damage
-        self.update_circle_colour()
+        self.paused = False
+        self._accumulator = 0
+        self._last_frame_time = self.clock.now()
 
-        if self.health <= 0:
-            self.remove_circle()
+    def run_frame(self):
+        """
+        Runs the simulation ticks that are due, draws once and schedules the next frame.
+        """
+        now = self.clock.now()
+        elapsed = now - self._last_frame_time
+        self._last_frame_time = now
 
+        if self.paused:
+            ticks = 0
+            delay = self.frame_delay
+        elif self.time_scale is None:
+            ticks = self.run_ticks_until(now + self.frame_delay)
+            # Only give Tk a chance to handle events, unless there was nothing to run
+            delay = 1 if ticks else self.frame_delay
+        else:
+            ticks = self.run_due_ticks(elapsed * self.time_scale,
+                                       self.max_ticks_per_frame * ceil(self.time_scale))
+            delay = self.frame_delay
 
-class MapGenerator:
-    """
-    A class that generates and draws a map based on given parameters.
+        self.count_ticks(ticks)
+        self.draw()
 
-    Attributes:
-        master (Tk): The master widget.
-        width (int): The width of the map.
-        height (int): The height of the map.
-        cell_size (int): The size of each cell in the map.
-        canvas (Tk.Canvas): The canvas widget to draw the map on.
-        map (list): A 2D list representing the map.
-        path_coordinates (list): A list to store the coordinates of the selected path.
-    """
+        if self.running:
+            self._after_id = self.root.after(delay, self.run_frame)
 
-    def __init__(self, master, width, height, cell_size):
+    def run_due_ticks(self, elapsed, max_ticks):
         """
-        Initializes a MapGenerator object.
+        Runs one tick for every step_ms of game time that has passed.
 
         Args:
-            master (Tk): The master widget.
-            width (int): The width of the map.
-            height (int): The height of the map.
-            cell_size (int): The size of each cell in the map.
+            elapsed (float): The game time that has passed since the last frame.
+            max_ticks (int): The maximum number of ticks to run.
+
+        Returns:
+            int: The number of ticks run.
         """
-        self.master = master
-        self.width = width
-        self.height = height
-        self.cell_size = cell_size
-        self.canvas = master
-        self.canvas.pack()
+        self._accumulator += elapsed
 
-        self.map = [[0 for _ in range(width)]
-                    for _ in range(height)]  # Initialize the map
-        self.path_coordinates = []  # To store the coordinates of the selected path
+        ticks = 0
+        step_ms = self.simulation.step_ms
+        while self._accumulator >= step_ms and ticks < max_ticks:
+            self.simulation.step()
+            self._accumulator -= step_ms
+            ticks += 1
 
-    def get_path_coordinates(self):
-        """
-        Returns the coordinates of the selected path.
+        if ticks == max_ticks:
+            # Too far behind, drop the backlog instead of spiralling
+            self._accumulator = min(self._accumulator, step_ms)
+        return ticks
 
-        Returns:
-            list: The coordinates of the selected path.
+    def run_ticks_until(self, deadline):
         """
-        return self.path_coordinates
+        Runs ticks back to back until the deadline or until the simulation stops.
 
-    def draw_map(self):
-        """
-        Draws the map on the canvas.
+        Args:
+            deadline (float): The clock time at which to stop, in milliseconds.
+
+        Returns:
+            int: The number of ticks run.
         """
-        for y, row in enumerate(self.map):
-            for x, cell in enumerate(row):
-                # dark brown for road, green for grass
-                color = "#8B4513" if cell == 1 else "green"
-                self.canvas.create_rectangle(x * self.cell_size, y * self.cell_size,
-                                             (x + 1) * self.cell_size, (y +
-                                                                        1) * self.cell_size,
-                                             fill=color)
+        ticks = 0
+        while self.simulation.running and self.clock.now() < deadline:
+            self.simulation.step()
+            ticks += 1
+        return ticks
 
-    def draw_map_from_file(self, filename):
+    def count_ticks(self, ticks):
         """
-        Draws the map based on the coordinates provided in a file.
+        Adds ticks to the throughput counter and updates ticks_per_second every second.
 
         Args:
-            filename (str): The path to the file containing the coordinates.
+            ticks (int): The number of ticks run this frame.
         """
-        with open(filename, "r", encoding="utf8") as file:
-            lines = file.readlines()
-            coordinates = [ast.literal_eval(line.strip()) for line in lines]
-
-        # Set the coordinates from the file as the new path
-        for coordinate in coordinates:
-            x, y = coordinate
-            self.map[y][x] = 1
-            self.path_coordinates.append((x, y))
-
-        # Redraw the updated map
-        self.draw_map()
+        self._throughput_ticks += ticks
+        window = self._last_frame_time - self._throughput_start
+        if window >= 1000:
+            self.ticks_per_second = self._throughput_ticks * 1000 / window
+            self._throughput_start = self._last_frame_time
+            self._throughput_ticks = 0
 
 
 class Game:
@@ -831,30 +1094,27 @@ class Game:
     The Game class is responsible for initializing and managing the Tower Defense game.
     It sets up the game window, initializes game variables, creates GUI elements,
     and binds event handlers.
-    It also loads the boss image, creates the map, and starts the game loop.
+    It also creates the map and starts the game loop.
 
     Attributes:
         root (Tk): The root window of the game.
-        circles (list): A list to store the circles in the game.
         cell_size (int): The size of each cell in the game map.
-        towers (list): A list to store the towers in the game.
-        tower_coordinates (dict): A dictionary to store the coordinates of each tower.
         player (Player): The player object representing the player in the game.
+        simulation (Simulation): The headless engine that owns the towers, circles and waves.
         leaderboard (Leaderboard): The leaderboard object representing the leaderboard in the game.
         cheat_money_key (str): The key to activate the money cheat.
         cheat_health_key (str): The key to activate the health cheat.
         boss_key (str): The key to toggle the visibility of the boss frame.
-        boss_image (ImageTk.PhotoImage): The image of the boss.
+        boss_image (ImageTk.PhotoImage): The image of the boss (None until first shown).
         game_in_progress (bool): A flag indicating whether the game is in progress.
-        current_wave (int): The current wave number.
-        num_circles_per_wave (list): A list of the number of circles per wave.
-        time_between_waves (int): The time between waves in milliseconds.
         frame (TkFrame): The frame that holds the canvas.
         selection_frame (TkFrame): The frame that holds the buttons.
         score_label (TkLabel): The label to display the player's score.
         health_label (TkLabel): The label to display the player's health.
         money_label (TkLabel): The label to display the player's money.
         selected_tower_label (TkLabel): The label to display the selected tower.
+        speed_options (list): The (time scale, name) pairs the game speed cycles through.
+        speed_label (TkLabel): The label to display the game speed and simulation throughput.
         selected_tower_type (str): The type of the selected tower.
         basic_tower_price (int): The price of the basic tower.
         sniper_tower_price (int): The price of the sniper tower.
@@ -866,6 +1126,11 @@ class Game:
         boss_canvas (TkCanvas): The canvas that displays the boss image.
         map_generator (MapGenerator):
         The map generator object responsible for creating and displaying the game map.
+        renderer (CanvasRenderer): The renderer that draws the simulation onto the canvas.
+        placement_preview (PlacementPreview): The preview of the selected tower under the mouse.
+        coverage_heatmap (CoverageHeatmap): The overlay showing the coverage of each tile.
+        heatmap_visible (bool): A flag indicating whether the coverage heatmap is shown.
+        game_loop (GameLoop): The loop that advances the simulation and draws each frame.
     """
 
     def __init__(self):
@@ -874,7 +1139,7 @@ class Game:
 
         This function sets up the game window, initializes game variables, creates GUI elements,
         and binds event handlers.
-        It also loads the boss image, creates the map, and starts the game loop.
+        It also creates the map and starts the game loop.
 
         Parameters:
         None
@@ -887,13 +1152,16 @@ class Game:
         self.root.geometry("1280x720")
         self.root.resizable(False, False)
         self.root.config(bg="black")
-        self.circles = []
         self.cell_size = 20
-        self.towers = []
-        self.tower_coordinates = {}
 
         # this is the player
         self.player = Player()
+        # this is the headless engine that runs the game
+        self.simulation = Simulation(load_route(), self.player, self.cell_size)
+        self.simulation.on_new_wave = self.announce_wave
+        self.simulation.on_game_over = self.game_over
+        self.simulation.on_circle_killed = self.circle_killed
+        self.simulation.on_circle_escaped = self.circle_escaped
         # this is the leaderboard
         self.leaderboard = Leaderboard()
 
@@ -901,24 +1169,14 @@ class Game:
         self.cheat_health_key = 'v'  # Default cheat health key
         self.boss_key = 'b'  # Default boss key
 
-        # Load the boss image
-        boss_img = Image.open("important_document_cropped.jpg")
-        boss_img = boss_img.resize((1280, 720), Image.LANCZOS)
-        self.boss_image = ImageTk.PhotoImage(boss_img)
+        # The boss image is loaded the first time the boss frame is shown
+        self.boss_image = None
 
         self.root.bind("<Key>", self.cheat_handler)  # Cheat handler
 
         # variable to check if the game is in progress:
         self.game_in_progress = False
 
-        # these are the waves
-        self.current_wave = 0
-        self.num_circles_per_wave = [
-            5 + 5 * i
-            for i in range(100)
-        ]
-        self.time_between_waves = 1000  # 1 second between waves
-
         # this is the frame that holds the canvas
         self.frame = TkFrame(self.root, width=1000, height=720, bg="blue")
         self.frame.pack(side='left')
@@ -943,6 +1201,18 @@ class Game:
             self.selection_frame, text="Selected Tower: None", bg="gray")
         self.selected_tower_label.pack(pady=5)
 
+        # Game speed controls
+        self.speed_options = [(1, "1x"), (2, "2x"), (4, "4x"), (None, "Max")]
+        self.speed_label = TkLabel(
+            self.selection_frame, text="Speed: 1x", bg="gray")
+        self.speed_label.pack(pady=5)
+        speed_button = TkButton(
+            self.selection_frame,
+            text="Change Speed",
+            command=self.cycle_speed
+        )
+        speed_button.pack(pady=5)
+
         # Tower selection buttons:
         button_width = 100
         button_height = 120
@@ -950,8 +1220,8 @@ class Game:
         # Variable to store the selected tower type:
         self.selected_tower_type = None
 
-        self.basic_tower_price = 220
-        basic_tower_image = PhotoImage(file="basic.png")
+        self.basic_tower_price = TOWER_PRICES["basic"]
+        basic_tower_image = load_tower_image("basic")
         basic_tower_button = TkButton(
             self.selection_frame,
             text=f"Normal Tower\nPrice: {self.basic_tower_price}",
@@ -962,8 +1232,8 @@ class Game:
             height=button_height
         )
         basic_tower_button.pack(pady=10)
-        self.sniper_tower_price = 400
-        sniper_tower_image = PhotoImage(file="sniper.png")
+        self.sniper_tower_price = TOWER_PRICES["sniper"]
+        sniper_tower_image = load_tower_image("sniper")
         sniper_tower_button = TkButton(
             self.selection_frame,
             text=f"Sniper Tower\nPrice: {self.sniper_tower_price}",
@@ -974,8 +1244,8 @@ class Game:
             height=button_height
         )
         sniper_tower_button.pack(pady=10)
-        self.machine_gun_tower_price = 350
-        machine_gun_tower_image = PhotoImage(file="machine_gun.png")
+        self.machine_gun_tower_price = TOWER_PRICES["machine_gun"]
+        machine_gun_tower_image = load_tower_image("machine_gun")
         machine_gun_tower_button = TkButton(
             self.selection_frame,
             text=f"Machine Gun\nPrice: {self.machine_gun_tower_price}",
@@ -1002,6 +1272,8 @@ class Game:
         self.canvas.pack()
 
         self.canvas.bind("<Button-1>", self.place_tower)
+        self.canvas.bind("<Motion>", self.preview_tower)
+        self.canvas.bind("<Leave>", lambda event: self.placement_preview.hide())
 
         # Main menu screen
         self.main_menu = MainMenu(self.root, self)
@@ -1014,6 +1286,17 @@ class Game:
         self.menu.add_command(label="Start Game",
                               command=self.start_game)  # start button
 
+        speed_menu = TkMenu(self.menu, tearoff=0)
+        for time_scale, name in self.speed_options:
+            speed_menu.add_command(label=name,
+                                   command=lambda scale=time_scale: self.set_speed(scale))
+        self.menu.add_cascade(label="Speed", menu=speed_menu)
+
+        placement_menu = TkMenu(self.menu, tearoff=0)
+        placement_menu.add_command(label="Coverage Heatmap", command=self.toggle_heatmap)
+        placement_menu.add_command(label="Suggest Best Tile", command=self.suggest_tile)
+        self.menu.add_cascade(label="Placement", menu=placement_menu)
+
         self.menu.add_command(label="Exit program",
                               command=self.root.quit)  # exit button
 
@@ -1028,19 +1311,25 @@ class Game:
                                     width=1280,
                                     height=720,
                                     bg="white")
-        self.boss_canvas.create_image(0, 0,
-                                      image=self.boss_image,
-                                      anchor="nw")
         self.boss_canvas.pack()
 
         # Create and display the map
         self.map_generator = MapGenerator(
-            self.canvas, 50, 36, cell_size=self.cell_size)
+            self.canvas, 50, 36, cell_size=self.cell_size, use_background_image=True)
 
-        self.map_generator.draw_map_from_file("coords.txt")
+        self.map_generator.draw_map_from_file(MAP_FILE)
+        self.coverage_heatmap = CoverageHeatmap(self.canvas, self.cell_size)
+        self.heatmap_visible = False
 
-        self.start_circles()
+        self.renderer = CanvasRenderer(self.canvas, self.simulation, self.cell_size)
+        self.placement_preview = PlacementPreview(self.canvas, self.cell_size)
+        self.game_loop = GameLoop(self.root, self.simulation, self.draw_frame)
+        self.game_loop.start()
 
+    def run(self):
+        """
+        Runs the game until the window is closed.
+        """
         self.root.mainloop()
 
     def cheat_handler(self, event):
@@ -1082,8 +1371,24 @@ class Game:
         if self.boss_frame.winfo_ismapped():
             self.boss_frame.place_forget()
         else:
+            self.load_boss_image()
             self.boss_frame.place(x=0, y=0)
 
+    def load_boss_image(self):
+        """
+        Loads the boss image onto the boss canvas the first time it is needed.
+
+        Decoding and resizing the image is slow, so it is not done before the boss
+        frame is first shown.
+        """
+        if self.boss_image is None:
+            with Image.open("important_document_cropped.jpg") as image:
+                boss_img = image.resize((1280, 720), Image.LANCZOS)
+            self.boss_image = ImageTk.PhotoImage(boss_img)
+            self.boss_canvas.create_image(0, 0,
+                                          image=self.boss_image,
+                                          anchor="nw")
+
     def show_game_over_screen(self):
         """
         Display the game over screen with a canvas/frame for entering initials.
@@ -1152,39 +1457,38 @@ class Game:
             )
             entry_label.pack(pady=5)
 
-    def check_wave_completion(self):
-        """
-        Check if all circles have reached the end of the game area.
-        If there are still circles remaining, the function will be called again after a short delay.
-        If all circles have reached the end, it will start a new wave of circles.
-        If the player's game is over, it will call the game_over function.
+    def announce_wave(self, wave):
         """
-        if self.circles:
-            # Check again after a short delay
-            self.root.after(100, self.check_wave_completion)
-        else:
-            # All circles have reached the end, start the new wave
-            if self.player.is_game_over():
-                self.game_over()
-            self.root.after(self.time_between_waves, self.new_wave)
+        Displays a message box with the new wave number.
+        The game waits while the message box is open.
 
-    def new_wave(self):
-        """
-        Increments the wave counter, displays a message box with the new wave number,
-        creates circles for the current wave, and schedules the next wave if the player
-        has not lost.
+        Args:
+            wave (int): The number of the wave that is starting.
         """
-        if self.player.is_game_over():
-            return
-        self.current_wave += 1
+        self.game_loop.pause()
         messagebox.showinfo(
             "New Wave",
-            f"Starting wave {self.current_wave}!"
+            f"Starting wave {wave}!"
         )
-        num_circles = self.num_circles_per_wave[self.current_wave - 1]
-        self.create_circles(num_circles)
-        if not self.player.is_game_over():
-            self.check_wave_completion()
+        self.game_loop.resume()
+
+    def circle_killed(self, _circle):
+        """
+        Prints the player's money and score after a tower kills a circle.
+
+        Args:
+            _circle (MovingCircle): The circle that was killed.
+        """
+        print(f"Circle removed! Money: {self.player.money} Score: {self.player.score}")
+
+    def circle_escaped(self, _circle):
+        """
+        Prints the player's health after a circle gets away.
+
+        Args:
+            _circle (MovingCircle): The circle that got away.
+        """
+        print(f"Circle got away! Player health: {self.player.health}")
 
     def game_over(self):
         """
@@ -1193,7 +1497,7 @@ class Game:
         self.game_in_progress = False
         messagebox.showinfo(
             "Game Over",
-            f"Game Over!\nWaves Survived: {self.current_wave}"
+            f"Game Over!\nWaves Survived: {self.simulation.current_wave}"
         )
         self.show_game_over_screen()
 
@@ -1215,63 +1519,42 @@ class Game:
         self.health_label.config(text=f"Health: {self.player.health}")
         self.money_label.config(text=f"Money: {self.player.money}")
 
-    def create_circles(self, num_circles):
+    def draw_frame(self):
+        """
+        Redraw the canvas and the player's information labels.
         """
-        Create a specified number of circles and add them to the game.
+        self.renderer.draw()
 
-        Args:
-            num_circles (int): The number of circles to create.
+        # Update player info
+        self.update_player_info()
+        self.update_speed_info()
 
-        Returns:
-            None
+    def update_speed_info(self):
         """
-        for _ in range(num_circles):
-            circle = MovingCircle(self.canvas,
-                                  player=self.player,
-                                  game=self)
-            self.circles.append(circle)
-
-    def update_circles(self, circle_index=0):
+        Update the speed label with the current game speed and simulation throughput.
         """
-        Update the circles in the game.
+        speed_name = dict(self.speed_options)[self.game_loop.time_scale]
+        self.speed_label.config(
+            text=f"Speed: {speed_name} ({self.game_loop.ticks_per_second:.0f} ticks/s)")
 
-        Parameters:
-        - circle_index (int): The index of the circle to be updated. Default is 0.
-
-        Returns:
-        None
+    def set_speed(self, time_scale):
         """
-        if circle_index < len(self.circles):
-            # Move the circle
-            self.circles[circle_index].move_circle()
-
-            # Check for game over
-            if self.player.is_game_over():
-                self.game_over()
-                return
-
-            # Update player info
-            self.update_player_info()
-
-            # Schedule the next update with a delay
-            delay_between_circles = 400  # Adjust this value as needed
-            self.root.after(delay_between_circles,
-                            self.update_circles,
-                            circle_index + 1)
+        Sets how fast the game runs.
 
-        else:
-            # All circles have been moved, schedule the next update
-            self.root.after(1000, self.update_circles)
-
-    def start_circles(self):
+        Args:
+            time_scale (float): How many times faster than real time the game runs,
+                or None to run as fast as possible.
         """
-        Start the circles animation.
+        self.game_loop.set_time_scale(time_scale)
+        self.update_speed_info()
 
-        This method starts the animation of circles by calling the necessary functions.
-        It first starts the tower updates and then updates the circles.
+    def cycle_speed(self):
         """
-        self.start_tower_updates()
-        self.update_circles()
+        Switches to the next game speed, going back to 1x after max speed.
+        """
+        time_scales = [time_scale for time_scale, _ in self.speed_options]
+        index = time_scales.index(self.game_loop.time_scale)
+        self.set_speed(time_scales[(index + 1) % len(time_scales)])
 
     def select_tower(self, tower_type):
         """
@@ -1289,6 +1572,56 @@ class Game:
         self.selected_tower_label.config(
             text=f"Selected Tower: {tower_type.title()}"
         )
+        self.update_heatmap()
+
+    def toggle_heatmap(self):
+        """
+        Shows or hides the coverage heatmap of the selected tower type.
+        """
+        self.heatmap_visible = not self.heatmap_visible
+        if self.heatmap_visible:
+            self.update_heatmap()
+        else:
+            self.coverage_heatmap.hide()
+
+    def update_heatmap(self):
+        """
+        Redraws the coverage heatmap for the selected tower type (basic if none is
+        selected) if it is shown.
+        """
+        if not self.heatmap_visible:
+            return
+        tower_range = TOWER_RANGES[self.selected_tower_type or "basic"]
+        self.coverage_heatmap.show(self.simulation.tile_coverage.counts_for(tower_range),
+                                   self.simulation.occupancy.tiles == TILE_FREE)
+
+    def suggest_tile(self):
+        """
+        Shows the free tile suggested by Simulation.best_tile for the selected tower
+        type (basic if none is selected): the one covering the most of the path, with
+        each part of the path counted less the more damage the towers already placed
+        deal there.
+        """
+        tower_type = self.selected_tower_type or "basic"
+        tower_range = TOWER_RANGES[tower_type]
+        best = self.simulation.best_tile(**TOWER_STATS[tower_type])
+        if best is None:
+            coverage = self.simulation.tile_coverage.weighted_counts(
+                tower_range, np.ones(len(self.simulation.route)))
+            if coverage[self.simulation.occupancy.tiles == TILE_FREE].max(initial=0) <= 0:
+                message = "No free tile is in range of the path for a"
+            else:
+                message = "No free tile is better than another for a"
+            messagebox.showinfo("Suggest Best Tile",
+                                f"{message} {tower_type.replace('_', ' ')} tower!")
+            return
+        x, y = best
+        self.placement_preview.show(tower_type, x, y, tower_range, True,
+                                    self.simulation.tile_coverage.count(x, y, tower_range),
+                                    len(self.simulation.route))
+        messagebox.showinfo("Suggest Best Tile",
+                            f"The suggested tile for a {tower_type.replace('_', ' ')} tower "
+                            f"is at ({x}, {y}).")
 
     def place_tower(self, event):
         """
@@ -1311,51 +1644,49 @@ class Game:
                     cost = self.basic_tower_price
                     if not self.can_afford_tower(cost):
                         return
-                    basic_tower = Tower(self.canvas,
-                                        3,
-                                        self.cell_size,
-                                        player=self.player,
-                                        tower_range=200,
-                                        fire_rate=800,
-                                        dps=20,
-                                        tower_type="basic")
-                    self.towers.append(basic_tower)
-                    self.tower_coordinates[basic_tower] = (x, y)
-                    basic_tower.place_image_tower(x, y)
+                    self.simulation.add_tower(x, y, **TOWER_STATS["basic"],
+                                              tower_type="basic")
                     self.update_player_info()
                 elif self.selected_tower_type == "sniper":
                     cost = self.sniper_tower_price
                     if not self.can_afford_tower(cost):
                         return
-                    sniper_tower = Tower(self.canvas,
-                                         3,
-                                         self.cell_size,
-                                         player=self.player,
-                                         fire_rate=2000,
-                                         dps=30,
-                                         tower_type="sniper")
-                    self.towers.append(sniper_tower)
-                    self.tower_coordinates[sniper_tower] = (x, y)
-                    sniper_tower.place_image_tower(x, y)
+                    self.simulation.add_tower(x, y, **TOWER_STATS["sniper"],
+                                              tower_type="sniper")
                     self.update_player_info()
                 elif self.selected_tower_type == "machine_gun":
                     cost = self.machine_gun_tower_price
                     if not self.can_afford_tower(cost):
                         return
-                    machine_gun_tower = Tower(self.canvas,
-                                              3,
-                                              self.cell_size,
-                                              player=self.player,
-                                              tower_range=150,
-                                              fire_rate=200,
-                                              dps=10,
+                    self.simulation.add_tower(x, y, **TOWER_STATS["machine_gun"],
                                               tower_type="machine_gun")
-                    self.towers.append(machine_gun_tower)
-                    self.tower_coordinates[machine_gun_tower] = (x, y)
-                    machine_gun_tower.place_image_tower(x, y)
                     self.update_player_info()
                 else:
                     print("No tower selected!")
+                self.renderer.draw()
+                self.update_heatmap()
+                self.preview_tower(event)
+
+    def preview_tower(self, event):
+        """
+        Shows the selected tower under the mouse, with its range and how much of the
+        path it would cover from there.
+
+        Args:
+            event (Event): The mouse move event.
+
+        Returns:
+            None
+        """
+        if self.selected_tower_type is None:
+            return
+        x = event.x // self.cell_size
+        y = event.y // self.cell_size
+        tower_range = TOWER_RANGES[self.selected_tower_type]
+        self.placement_preview.show(self.selected_tower_type, x, y, tower_range,
+                                    self.simulation.occupancy.is_free(x, y),
+                                    self.simulation.tile_coverage.count(x, y, tower_range),
+                                    len(self.simulation.route))
 
     def tower_placement_valid(self, x, y):
         """
@@ -1369,28 +1700,14 @@ class Game:
             bool: True if the tower placement is valid, False otherwise.
         """
         # Check if the square under the tower is brown or if there is already a tower placed
-        # Convert tower coordinates to match the scale factor of path coordinates
-        x *= self.cell_size
-        y *= self.cell_size
-
-        # Check if the square under the tower is brown or if there is already a tower placed
-        path_x = x // self.cell_size
-        path_y = y // self.cell_size
-        if (
-            self.map_generator.map[path_y][path_x] == 1
-            or (path_x, path_y) in self.map_generator.get_path_coordinates()
-        ):
+        occupant = self.simulation.occupancy.get(x, y)
+        if occupant == TILE_ROAD:
             print("You cannot place a tower over the path!")
             return False
-
-        # Check if there is already a tower placed at the given coordinates
-        for tower in self.towers:
-            tower_x, tower_y = self.tower_coordinates[tower]
-            if tower_x == path_x and tower_y == path_y:
-                print("You cannot place a tower onto another tower!")
-                return False
-
-        return True
+        if occupant == TILE_TOWER:
+            print("You cannot place a tower onto another tower!")
+            return False
+        return occupant == TILE_FREE
 
     def can_afford_tower(self, cost):
         """
@@ -1411,46 +1728,23 @@ class Game:
         print(f"You need {cost - self.player.money} more money!")
         return False
 
-    def update_towers(self):
-        """
-        Update the towers by finding the closest circle and shooting at it if possible.
-        """
-        delay_between_shots = 100  # Frequent updates required to handle different fire rates
-
-        for tower in self.towers:
-            closest_circle = tower.find_closest_circle(self.circles)
-
-            if closest_circle and tower.can_shoot():
-                try:
-                    tower.shoot(closest_circle)
-                except AttributeError:
-                    continue  # The circle has been removed from the canvas, skip to next
-
-        self.root.after(delay_between_shots, self.update_towers)
-
-    def start_tower_updates(self):
-        """
-        Updates the towers in the game.
-        """
-        self.update_towers()
-
     def start_game(self):
         """
         Starts the game if it is not already in progress.
         If the game is already in progress, it prints a message and continues the game.
         """
         if not self.game_in_progress:
-            if self.current_wave == 0:
+            if self.simulation.current_wave == 0:
                 messagebox.showinfo("Game Started", "Game started!")
-            elif self.current_wave > 0:
+            elif self.simulation.current_wave > 0:
                 messagebox.showinfo(
                     "Game Started",
-                    f"Game resumed! Resuming from wave {self.current_wave + 1}"
+                    f"Game resumed! Resuming from wave {self.simulation.current_wave + 1}"
                 )
             else:
                 messagebox.showinfo("Game Started", "Game started!")
             self.game_in_progress = True
-            self.new_wave()
+            self.simulation.new_wave()
         else:
             print("Game already started!")  # to not stop the game.
 
@@ -1458,15 +1752,14 @@ class Game:
         """Save the current game state to a JSON file."""
         # save game logic here
         save_data = {
-            'towers': [{'coordinates': tower_coordinates,
-                        'type': tower.tower_type} for tower,
-                       tower_coordinates in self.tower_coordinates.items()],
+            'towers': [{'coordinates': [tower.x, tower.y],
+                        'type': tower.tower_type} for tower in self.simulation.towers],
             'player': {
                 'money': self.player.money,
                 'health': self.player.health,
                 'score': self.player.score,
             },
-            'current_wave': self.current_wave,
+            'current_wave': self.simulation.current_wave,
         }
 
         with open('save.json', 'w', encoding="utf8") as save_file:
@@ -1481,8 +1774,12 @@ def main():
     """
     The main function of the game_solution module.
     """
-    Game()
+    Game().run()
+
 
 
 if __name__ == "__main__":
-    main()  # this will initialise the program
+    if sys.argv[1:2] == ["batch"]:
+        batch_main(sys.argv[2:])
+    else:
+        main()  # this will initialise the program
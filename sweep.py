@@ -0,0 +1,339 @@
+"""
+Parameter sweeps for balancing the Tower Defense Game.
+
+Run with `python3 sweep.py <layout> --param <name> <low> <high> ...`, where layout is
+a build order in the same format as save.json. Each sample plays the layout without
+a window, buying its towers in order as soon as the player can afford them, and the
+results are saved as one NumPy array per column in an .npz file. The file doubles as
+a checkpoint: running the same sweep again only plays the samples still missing.
+
+Parameter names are:
+    tower.<type>.<stat>  where stat is dps, fire_rate, tower_range or price
+    enemy.<type>.<stat>  where stat is one of the EnemyTypes stats, like health
+    wave.base, wave.growth  for num_circles_per_wave = base + growth * (wave - 1)
+"""
+import argparse
+import itertools
+import json
+import os
+import signal
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from engine import (ENEMY_FILE, TOWER_PRICES, TOWER_STATS, TOWER_STATS_TABLES, EnemyTypes,
+                    Simulation, check_layout, simulate_layout)
+
+RESULTS = ("waves_survived", "towers_built", "score", "money", "health")
+INTEGER_PARAMETERS = ("price", "base", "growth", "reward", "score", "damage", "radius")
+DEFAULT_WAVE_BASE = 5  # The num_circles_per_wave of the Simulation
+DEFAULT_WAVE_GROWTH = 5
+
+
+def check_parameter(name, low, high, enemy_names):
+    """
+    Raise a ValueError if name is not a parameter the sweep knows how to set, or
+    its range is not two numbers.
+
+    Args:
+        name (str): The parameter name.
+        low (str): The lowest value of the parameter.
+        high (str): The highest value of the parameter.
+        enemy_names (list): The names of the enemy types.
+    """
+    for value in (low, high):
+        float(value)
+    parts = name.split(".")
+    if parts[0] == "tower" and len(parts) == 3:
+        valid = parts[1] in TOWER_STATS and parts[2] in ("dps", "fire_rate", "tower_range",
+                                                         "price")
+    elif parts[0] == "enemy" and len(parts) == 3:
+        valid = parts[1] in enemy_names and parts[2] in EnemyTypes.STATS
+    else:
+        valid = name in ("wave.base", "wave.growth")
+    if not valid:
+        raise ValueError(f"Unknown parameter: {name}")
+
+
+def grid_samples(ranges, steps):
+    """
+    Return every combination of evenly spaced values of each parameter.
+
+    Args:
+        ranges (list): The (low, high) range of each parameter.
+        steps (int): The number of values of each parameter.
+
+    Returns:
+        ndarray: One row per sample, one column per parameter.
+    """
+    axes = [np.linspace(low, high, steps) for low, high in ranges]
+    return np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(-1, len(ranges))
+
+
+def random_samples(ranges, count, rng, latin_hypercube=False):
+    """
+    Return samples drawn uniformly from the parameter ranges.
+
+    With a Latin hypercube every parameter range is cut into count equal slices and
+    each slice is sampled exactly once, which covers the ranges more evenly than
+    drawing every sample on its own.
+
+    Args:
+        ranges (list): The (low, high) range of each parameter.
+        count (int): The number of samples.
+        rng (Generator): The random number generator.
+        latin_hypercube (bool, optional): Whether to use a Latin hypercube (default is False).
+
+    Returns:
+        ndarray: One row per sample, one column per parameter.
+    """
+    shares = rng.random((count, len(ranges)))
+    if latin_hypercube:
+        slices = np.column_stack([rng.permutation(count) for _ in ranges])
+        shares = (slices + shares) / count
+    low, high = np.array(ranges, dtype=float).T
+    return low + shares * (high - low)
+
+
+def sample_settings(names, values, enemy_types, base_tower_stats):
+    """
+    Turn one sample into the settings simulate_layout plays it with.
+
+    Args:
+        names (list): The parameter names.
+        values (ndarray): The value of each parameter.
+        enemy_types (list): One dictionary per enemy type with its name and stats,
+            as in the enemy types file.
+        base_tower_stats (dict): The stats of each tower type the parameters change.
+
+    Returns:
+        dict: The tower_stats, tower_prices, enemy_types and num_circles_per_wave.
+    """
+    tower_stats = {tower_type: dict(stats) for tower_type, stats in base_tower_stats.items()}
+    tower_prices = dict(TOWER_PRICES)
+    enemy_types = {enemy_type["name"]: dict(enemy_type) for enemy_type in enemy_types}
+    wave = {"base": DEFAULT_WAVE_BASE, "growth": DEFAULT_WAVE_GROWTH}
+
+    for name, value in zip(names, values):
+        parts = name.split(".")
+        if parts[-1] in INTEGER_PARAMETERS:
+            value = int(round(value))
+        else:
+            value = float(value)
+        if parts[0] == "tower" and parts[2] == "price":
+            tower_prices[parts[1]] = value
+        elif parts[0] == "tower":
+            tower_stats[parts[1]][parts[2]] = value
+        elif parts[0] == "enemy":
+            enemy_types[parts[1]][parts[2]] = value
+        else:
+            wave[parts[1]] = value
+
+    return {
+        "tower_stats": tower_stats,
+        "tower_prices": tower_prices,
+        "enemy_types": EnemyTypes(list(enemy_types.values())),
+        "num_circles_per_wave": [wave["base"] + wave["growth"] * i for i in range(100)],
+    }
+
+
+def play_sample(layout, waves, names, values, enemy_types, base_tower_stats):
+    """
+    Play the layout with the settings of one sample.
+
+    Args:
+        layout (dict): The build order, in the same format as save.json.
+        waves (int): The number of waves to play.
+        names (list): The parameter names.
+        values (ndarray): The value of each parameter.
+        enemy_types (list): The enemy types, as in the enemy types file.
+        base_tower_stats (dict): The stats of each tower type the parameters change.
+
+    Returns:
+        tuple: The value of each of the RESULTS.
+    """
+    result = simulate_layout(layout, waves,
+                             **sample_settings(names, values, enemy_types, base_tower_stats))
+    return (result["waves_survived"], result["towers_built"], result["score"][-1],
+            result["money"][-1], result["health"][-1])
+
+
+def save_sweep(path, meta, names, samples, results, done):
+    """
+    Save the sweep as one array per column, replacing the file in one step so an
+    interrupted save never leaves a broken checkpoint.
+
+    Args:
+        path (str): The .npz file.
+        meta (dict): What the sweep was run with.
+        names (list): The parameter names.
+        samples (ndarray): One row per sample, one column per parameter.
+        results (ndarray): One row per sample, one column per result.
+        done (ndarray): Whether each sample has been played.
+    """
+    columns = {name: samples[:, column] for column, name in enumerate(names)}
+    columns.update({name: results[:, column] for column, name in enumerate(RESULTS)})
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as sweep_file:
+        np.savez_compressed(sweep_file, meta=json.dumps(meta), done=done, **columns)
+    os.replace(temporary_path, path)
+
+
+def load_sweep(path, meta, names):
+    """
+    Load the samples, results and progress of an earlier run of the same sweep.
+
+    Args:
+        path (str): The .npz file.
+        meta (dict): What this sweep is run with.
+        names (list): The parameter names.
+
+    Returns:
+        tuple: The samples, the results and which samples are done, or None if the
+        file does not exist.
+
+    Raises:
+        ValueError: If the file holds a different sweep.
+    """
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as sweep_file:
+        if json.loads(str(sweep_file["meta"])) != meta:
+            raise ValueError(f"{path} holds a different sweep, remove it or pick another output")
+        samples = np.column_stack([sweep_file[name] for name in names])
+        results = np.column_stack([sweep_file[name] for name in RESULTS])
+        return samples, results, sweep_file["done"]
+
+
+def ignore_interrupts():
+    """
+    Leave Ctrl-C to the main process, which saves the results played so far.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def run_sweep(args, layout, enemy_types, meta, checkpoint):
+    """
+    Play every sample not played yet, in parallel, saving a checkpoint as results
+    come in.
+
+    Only a few samples per worker are handed out at a time. On Ctrl-C the samples
+    not started yet are dropped, the ones being played are finished, and every
+    result is saved before the sweep stops.
+
+    Args:
+        args (Namespace): The parsed command line arguments.
+        layout (dict): The build order to play.
+        enemy_types (list): The enemy types, as in the enemy types file.
+        meta (dict): What the sweep is run with.
+        checkpoint (tuple): The samples, results and progress of an earlier run of
+            the same sweep, or None to start a new one.
+    """
+    names = [name for name, _, _ in args.param]
+    if checkpoint is not None:
+        samples, results, done = checkpoint
+    else:
+        ranges = [(float(low), float(high)) for _, low, high in args.param]
+        if args.method == "grid":
+            samples = grid_samples(ranges, args.steps)
+        else:
+            samples = random_samples(ranges, args.samples, np.random.default_rng(args.seed),
+                                     latin_hypercube=args.method == "lhs")
+        results = np.zeros((len(samples), len(RESULTS)), dtype=np.int64)
+        done = np.zeros(len(samples), dtype=bool)
+
+    todo = np.flatnonzero(~done)
+    print(f"{len(samples)} samples, {len(samples) - len(todo)} already played")
+    workers = args.workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=ignore_interrupts)
+    rows = iter(todo)
+    running = {}
+    played = 0
+    interrupted = False
+    start = time.perf_counter()
+    last_save = start
+    try:
+        while True:
+            for row in itertools.islice(rows, 2 * workers - len(running)):
+                running[executor.submit(play_sample, layout, args.waves, names, samples[row],
+                                        enemy_types,
+                                        TOWER_STATS_TABLES[args.tower_stats])] = row
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                row = running.pop(future)
+                results[row] = future.result()
+                done[row] = True
+                played += 1
+            if time.perf_counter() - last_save >= args.checkpoint_seconds:
+                save_sweep(args.output, meta, names, samples, results, done)
+                last_save = time.perf_counter()
+                print(f"{played}/{len(todo)} played in {last_save - start:.0f} s")
+    except KeyboardInterrupt:
+        interrupted = True
+        save_sweep(args.output, meta, names, samples, results, done)
+        executor.shutdown(wait=False, cancel_futures=True)
+        print("Interrupted, finishing the samples already started")
+        for future, row in running.items():
+            if not future.cancelled():
+                results[row] = future.result()
+                done[row] = True
+    finally:
+        save_sweep(args.output, meta, names, samples, results, done)
+        executor.shutdown(wait=False, cancel_futures=True)
+    if interrupted:
+        print(f"Saved {done.sum()} of {len(samples)} samples to {args.output}, "
+              "run the same command again to resume")
+        sys.exit(130)
+    print(f"Saved {args.output}")
+
+
+def main():
+    """
+    Parse the command line, check it and run the sweep.
+    """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("layout", help="the build order to play, like save.json")
+    parser.add_argument("--param", nargs=3, action="append", required=True,
+                        metavar=("NAME", "LOW", "HIGH"), help="a parameter and its range")
+    parser.add_argument("--method", choices=("grid", "random", "lhs"), default="grid")
+    parser.add_argument("--steps", type=int, default=3,
+                        help="the number of values of each parameter in a grid")
+    parser.add_argument("--samples", type=int, default=64,
+                        help="the number of random or Latin hypercube samples")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--waves", type=int, default=20, help="the number of waves to play")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="the number of processes (default is one per CPU)")
+    parser.add_argument("--tower-stats", choices=TOWER_STATS_TABLES, default="placed",
+                        help="start from the stats of towers placed during the game "
+                             "or of towers loaded from a save (default is placed)")
+    parser.add_argument("--checkpoint-seconds", type=float, default=30)
+    parser.add_argument("--output", default="sweep.npz")
+    args = parser.parse_args()
+
+    with open(args.layout, "r", encoding="utf8") as layout_file:
+        layout = json.load(layout_file)
+    with open(ENEMY_FILE, "r", encoding="utf8") as enemy_file:
+        enemy_types = json.load(enemy_file)
+    meta = {"layout": layout, "waves": args.waves, "parameters": args.param,
+            "method": args.method, "steps": args.steps, "samples": args.samples,
+            "seed": args.seed, "tower_stats": args.tower_stats}
+    try:
+        for name, low, high in args.param:
+            check_parameter(name, low, high, [enemy_type["name"] for enemy_type in enemy_types])
+        check_layout(layout, Simulation())
+        checkpoint = load_sweep(args.output, meta, [name for name, _, _ in args.param])
+    except ValueError as error:
+        parser.error(str(error))
+    if args.waves < 1:
+        parser.error("at least one wave has to be played")
+    run_sweep(args, layout, enemy_types, meta, checkpoint)
+
+
+if __name__ == "__main__":
+    main()